@@ -0,0 +1,55 @@
+
+import logging
+from os import makedirs
+from os.path import join
+from timeit import default_timer as timer
+from utile import (arg_parser, Arg, TemporaryDirectory, hash_dir, parse_env,
+                   write_file)
+from testsuite.support import TestCase
+
+
+class StressHashDirTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        parser = arg_parser(
+            'Benchmark serial and parallel hash_dir.',
+            Arg('--file-size', default=1, type=int),
+            Arg('--file-count', default=64, type=int),
+            Arg('--worker-count', default=4, type=int),
+            Arg('--algorithm', default='sha256'),
+            Arg('--debug', default=0, type=int),
+        )
+        args = parse_env(parser, 'utile', args=[])
+        for i in ['file_size', 'file_count', 'worker_count', 'algorithm']:
+            setattr(cls, i, getattr(args, i))
+        if args.debug:
+            logging.basicConfig(format='%(message)s', level=logging.DEBUG)
+        logging.debug('args: %s' % args)
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.dir = self.tmp.__enter__()
+        block = 'x' * 1024
+        for i in range(self.file_count):
+            sub = join(self.dir, 'dir%s' % (i % 8))
+            if i < 8:
+                makedirs(sub)
+            blocks = (block for j in range(self.file_size * 1024))
+            write_file(join(sub, 'file%s' % i), blocks)
+
+    def tearDown(self):
+        self.tmp.__exit__(None, None, None)
+
+    def timed_hash(self, **kwargs):
+        start = timer()
+        hashes = hash_dir(self.dir, self.algorithm, **kwargs)
+        logging.debug('{0:<40} {1:.3f}s'.format(str(kwargs), timer() - start))
+        return hashes
+
+    def test_hash_dir(self):
+        logging.debug('')   # start a new line
+        serial = self.timed_hash()
+        for executor in ['thread', 'process']:
+            parallel = self.timed_hash(
+                workers=self.worker_count, executor=executor)
+            self.assertEqual(parallel, serial)
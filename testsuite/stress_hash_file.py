@@ -0,0 +1,57 @@
+
+import logging
+from os.path import join
+from timeit import default_timer as timer
+from utile import (arg_parser, Arg, TemporaryDirectory, hash_file, parse_env,
+                   write_file)
+from testsuite.support import TestCase
+
+MODES = ['read', 'readinto', 'mmap']
+
+
+class StressHashFileTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        parser = arg_parser(
+            'Benchmark hash_file throughput for each read mode.',
+            Arg('--small-size', default=4, type=int, help='KiB'),
+            Arg('--small-count', default=1000, type=int),
+            Arg('--huge-size', default=64, type=int, help='MiB'),
+            Arg('--debug', default=0, type=int),
+        )
+        args = parse_env(parser, 'utile', args=[])
+        for i in ['small_size', 'small_count', 'huge_size']:
+            setattr(cls, i, getattr(args, i))
+        if args.debug:
+            logging.basicConfig(format='%(message)s', level=logging.DEBUG)
+        logging.debug('args: %s' % args)
+
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.dir = self.tmp.__enter__()
+
+    def tearDown(self):
+        self.tmp.__exit__(None, None, None)
+
+    def throughput(self, paths, size):
+        logging.debug('')   # start a new line
+        digests = []
+        for mode in MODES:
+            start = timer()
+            digests.append([hash_file(i, mode=mode).digest() for i in paths])
+            duration = timer() - start
+            logging.debug('{0:<10} {1:>10.1f} MiB/s'.format(
+                mode, size / duration / 1024 / 1024))
+        self.assertEqual(digests, [digests[0]] * len(MODES))
+
+    def test_small_files(self):
+        paths = [join(self.dir, str(i)) for i in range(self.small_count)]
+        for i in paths:
+            write_file(i, 'x' * self.small_size * 1024)
+        self.throughput(paths, self.small_size * 1024 * self.small_count)
+
+    def test_huge_file(self):
+        path = join(self.dir, 'huge')
+        blocks = ('x' * 1024 * 1024 for i in range(self.huge_size))
+        write_file(path, blocks)
+        self.throughput([path], self.huge_size * 1024 * 1024)
@@ -0,0 +1,46 @@
+import logging
+import re
+import sys
+import unittest
+from os.path import abspath, dirname
+from subprocess import check_output, STDOUT
+from utile import arg_parser, Arg, parse_env
+from testsuite.support import TestCase
+
+HEAVY_MODULES = ['subprocess', 'argparse', 'hashlib', 'tempfile', 'shutil',
+                 'inspect', 'datetime', 'json']
+CHECK_MODULES = """
+import sys
+import utile
+print(' '.join(i for i in %r if i in sys.modules))
+"""
+ROOT = dirname(dirname(abspath(__file__)))
+
+
+@unittest.skipIf(sys.version_info < (3, 7), '-X importtime requires 3.7')
+class StressImportTimeTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        parser = arg_parser(
+            'Benchmark the time taken to import utile.',
+            Arg('--max-import-time', default=50, type=float, help='ms'),
+            Arg('--debug', default=0, type=int),
+        )
+        args = parse_env(parser, 'utile', args=[])
+        cls.max_import_time = args.max_import_time
+        if args.debug:
+            logging.basicConfig(format='%(message)s', level=logging.DEBUG)
+        logging.debug('args: %s' % args)
+
+    def test_import_time(self):
+        output = check_output([sys.executable, '-X', 'importtime', '-c',
+                               'import utile'], stderr=STDOUT, cwd=ROOT)
+        match = re.search(r'\|\s*(\d+) \| utile$', output.decode(), re.M)
+        import_time = int(match.group(1)) / 1000.0
+        logging.debug('import utile: %.1f ms' % import_time)
+        self.assertLess(import_time, self.max_import_time)
+
+    def test_heavy_modules_not_loaded(self):
+        output = check_output([sys.executable, '-S', '-c',
+                               CHECK_MODULES % HEAVY_MODULES], cwd=ROOT)
+        self.assertEqual(output.decode().split(), [])
@@ -0,0 +1,72 @@
+
+import logging
+from timeit import default_timer as timer
+from utile import arg_parser, Arg, parse_env, Profiler
+from testsuite.support import TestCase
+
+
+class NoopSection(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class StressProfilerTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        parser = arg_parser(
+            'Benchmark the overhead of Profiler sections.',
+            Arg('--section-count', default=50000, type=int),
+            Arg('--repeat', default=10, type=int),
+            Arg('--max-overhead', default=3, type=float,
+                help='times the cost of a no-op with statement'),
+            Arg('--debug', default=0, type=int),
+        )
+        args = parse_env(parser, 'utile', args=[])
+        for i in ['section_count', 'repeat', 'max_overhead']:
+            setattr(cls, i, getattr(args, i))
+        if args.debug:
+            logging.basicConfig(format='%(message)s', level=logging.DEBUG)
+        logging.debug('args: %s' % args)
+
+    def per_section(self, *funcs):
+        # interleave the runs so drifting CPU speed affects funcs alike
+        durations = [[] for i in funcs]
+        for i in range(self.repeat):
+            for func, results in zip(funcs, durations):
+                start = timer()
+                func()
+                results.append(timer() - start)
+        return [min(i) / self.section_count * 1e9 for i in durations]
+
+    def test_section_overhead(self):
+        logging.debug('')   # start a new line
+        profiler = Profiler()
+        section = profiler.section
+        count = self.section_count
+
+        def empty():
+            for i in range(count):
+                pass
+
+        def noops():
+            for i in range(count):
+                with NoopSection():
+                    pass
+
+        def sections():
+            for i in range(count):
+                with section('bench'):
+                    pass
+
+        baseline, noop, timed = self.per_section(empty, noops, sections)
+        # relative to the no-op with, so the bound holds on any machine
+        noop, overhead = noop - baseline, timed - noop
+        logging.debug('no-op with: {0:.0f} ns'.format(noop))
+        logging.debug('overhead: {0:.0f} ns per section, {1:.1f}x'.format(
+            overhead, overhead / noop))
+        self.assertEqual(profiler.report()['bench']['count'],
+                         count * self.repeat)
+        self.assertLess(overhead / noop, self.max_overhead)
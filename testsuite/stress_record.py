@@ -0,0 +1,47 @@
+import logging
+import unittest
+from utile import arg_parser, Arg, parse_env, parse_table, safe_import
+from testsuite.support import TestCase
+
+tracemalloc = safe_import('tracemalloc')
+COLUMNS = ['id', 'name', 'size', 'owner', 'state']
+
+
+@unittest.skipUnless(tracemalloc, 'tracemalloc requires Python 3.4')
+class StressRecordTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        parser = arg_parser(
+            'Compare the memory used by bunch_or_dict and compact rows.',
+            Arg('--row-count', default=100000, type=int),
+            Arg('--debug', default=0, type=int),
+        )
+        args = parse_env(parser, 'utile', args=[])
+        cls.row_count = args.row_count
+        if args.debug:
+            logging.basicConfig(format='%(message)s', level=logging.DEBUG)
+        logging.debug('args: %s' % args)
+        ruler = '  '.join(['=' * 10] * len(COLUMNS))
+        header = '  '.join(i.ljust(10) for i in COLUMNS)
+        values = ([i, 'row', i * 10, 'nobody', 'active']
+                  for i in range(cls.row_count))
+        rows = ['  '.join(str(j).ljust(10) for j in i) for i in values]
+        cls.table = '\n'.join([ruler, header, ruler] + rows + [ruler])
+
+    def memory(self, **kwargs):
+        tracemalloc.start()
+        try:
+            rows = parse_table(self.table, **kwargs)
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        logging.debug('{0:<20} {1:>8.1f} MiB {2:>6.0f} bytes/row'.format(
+            str(kwargs), size / 2.0 ** 20, size / float(len(rows))))
+        return rows, size
+
+    def test_memory(self):
+        logging.debug('')   # start a new line
+        rows, size = self.memory()
+        records, compact_size = self.memory(compact=True)
+        self.assertEqual([i.to_dict() for i in records[:10]], rows[:10])
+        self.assertLess(compact_size, size)
@@ -1,5 +1,8 @@
 
 from os.path import join
+from timeit import default_timer as timer
+from functools import partial
+from multiprocessing import Process, Queue as ProcessQueue
 from utile import (arg_parser, Arg, TemporaryDirectory, ThrottleFilter,
                    parse_env, write_file)
 from threading import Thread
@@ -19,14 +22,18 @@ class SimpleFilter(object):
         return 1 if total <= self.limit else 0
 
 
-def worker(results, filter, count):
+def worker(results, filter, count, records=(None,)):
     for i in range(count):
         try:
-            results.put(filter.filter(None))
+            results.put(filter.filter(records[i % len(records)]))
         except:
             pass
 
 
+def process_worker(results, filter, count):
+    results.put(sum(filter.filter(None) for i in range(count)))
+
+
 class StressThrottleFilterTestCase(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -34,10 +41,11 @@ class StressThrottleFilterTestCase(TestCase):
             'Stress test ThrottleFilter.',
             Arg('--worker-count', default=10, type=int),
             Arg('--worker-calls', default=10, type=int),
+            Arg('--key-count', default=1000, type=int),
             Arg('--debug', default=0, type=int),
         )
         args = parse_env(parser, 'utile', args=[])
-        for i in ['worker_count', 'worker_calls']:
+        for i in ['worker_count', 'worker_calls', 'key_count']:
             setattr(cls, i, getattr(args, i))
         if args.debug:
             logging.basicConfig(format='%(message)s', level=logging.DEBUG)
@@ -66,5 +74,68 @@ class StressThrottleFilterTestCase(TestCase):
     def test_throttle_filter(self):
         self.assertEqual(self.stress(ThrottleFilter), self.expected)
 
+    def test_throttle_filter_counter(self):
+        filter_class = partial(ThrottleFilter, backend='counter')
+        self.assertEqual(self.stress(filter_class), self.expected)
+
+    def test_throttle_filter_counter_processes(self):
+        limit = self.expected // 2
+        with TemporaryDirectory() as tmp:
+            filter = ThrottleFilter(tmp, limit, backend='counter')
+            results = ProcessQueue()
+            processes = [
+                Process(target=process_worker,
+                        args=(results, filter, self.worker_calls))
+                for i in range(self.worker_count)
+            ]
+            for i in processes:
+                i.start()
+            allowed = sum(results.get() for i in processes)
+            for i in processes:
+                i.join()
+        self.assertEqual(allowed, limit)
+
+    def decisions(self, records=(None,), limit=None, **kwargs):
+        limit = limit or self.expected // 2
+        with TemporaryDirectory() as tmp:
+            filter = ThrottleFilter(tmp, limit, **kwargs)
+            if 'key' in kwargs:
+                for i in records:   # fill the counter with live keys
+                    filter.filter(i)
+            results = Queue()
+            threads = [
+                Thread(target=worker,
+                       args=(results, filter, self.worker_calls,
+                             records[i::self.worker_count] or records))
+                for i in range(self.worker_count)
+            ]
+            start = timer()
+            for i in threads:
+                i.start()
+            for i in threads:
+                i.join()
+            duration = timer() - start
+        results = [results.get() for i in range(results.qsize())]
+        logging.debug('{0:<10} {1:>10.0f} decisions/s'.format(
+            'keyed' if 'key' in kwargs else kwargs.get('mode', 'fixed'),
+            len(results) / duration))
+        self.assertEqual(len(results), self.expected)
+        return limit, sum(results)
+
+    def test_rate_modes(self):
+        logging.debug('')   # start a new line
+        limit, allowed = self.decisions(backend='counter')
+        self.assertEqual(allowed, limit)
+        limit, allowed = self.decisions(mode='sliding')
+        self.assertTrue(0 < allowed <= limit + 1)
+        limit, allowed = self.decisions(mode='token', burst=5)
+        self.assertIn(allowed, [5, 6])
+        records = [logging.makeLogRecord(dict(msg='message %d' % i))
+                   for i in range(self.key_count)]
+        # every key is at its limit, so evicting any of them lets one through
+        limit, allowed = self.decisions(records, 1, key='message',
+                                        max_keys=self.key_count)
+        self.assertEqual(allowed, 0)
+
     def test_simple_filter(self):
         self.assertNotEqual(self.stress(SimpleFilter), self.expected)
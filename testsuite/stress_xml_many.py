@@ -0,0 +1,51 @@
+import logging
+import unittest
+from timeit import default_timer as timer
+from utile import (arg_parser, Arg, parse_env, xml_to_dict, xml_to_dict_many,
+                   pretty_xml_many)
+from testsuite.support import etree, TestCase
+
+ITEM = '<item><id>{0}</id><name>item {0}</name><price>{0}.99</price></item>'
+
+
+@unittest.skipUnless(etree, 'lxml not installed')
+class StressXMLManyTestCase(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        parser = arg_parser(
+            'Benchmark xml_to_dict_many and pretty_xml_many scaling by cores.',
+            Arg('--doc-count', default=5000, type=int),
+            Arg('--doc-items', default=20, type=int),
+            Arg('--max-workers', default=4, type=int),
+            Arg('--debug', default=0, type=int),
+        )
+        args = parse_env(parser, 'utile', args=[])
+        for i in ['doc_count', 'doc_items', 'max_workers']:
+            setattr(cls, i, getattr(args, i))
+        if args.debug:
+            logging.basicConfig(format='%(message)s', level=logging.DEBUG)
+        logging.debug('args: %s' % args)
+        items = ''.join(ITEM.format(i) for i in range(cls.doc_items))
+        cls.xmls = ['<doc id="%s">%s</doc>' % (i, items)
+                    for i in range(cls.doc_count)]
+
+    def throughput(self, func, workers):
+        start = timer()
+        results = func(self.xmls, workers)
+        duration = timer() - start
+        logging.debug('{0:<16} workers={1} {2:>8.0f} docs/s'.format(
+            func.__name__, workers, len(self.xmls) / duration))
+        return results
+
+    def test_scaling(self):
+        logging.debug('')   # start a new line
+        start = timer()
+        serial = [xml_to_dict(i) for i in self.xmls]
+        logging.debug('{0:<26} {1:>8.0f} docs/s'.format(
+            'xml_to_dict', len(self.xmls) / (timer() - start)))
+        workers = 1
+        while workers <= self.max_workers:
+            self.assertEqual(self.throughput(xml_to_dict_many, workers),
+                             serial)
+            self.throughput(pretty_xml_many, workers)
+            workers *= 2
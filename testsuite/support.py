@@ -32,6 +32,7 @@ mock = safe_import('mock')
 etree = safe_import('lxml.etree')
 Crypto = safe_import('Crypto')
 yaml = safe_import('yaml')
+numpy = safe_import('numpy')
 
 
 # function to convert init to bytes for python 2 and 3
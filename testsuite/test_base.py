@@ -1,21 +1,28 @@
 
 import os
+import logging
 import platform
 from subprocess import Popen, PIPE
 from tempfile import NamedTemporaryFile
 from os.path import exists, join
 import datetime
 import os.path
+import pickle
+import sys
+import time
 import unittest
+from threading import Thread
 from testsuite.support import (
-    patch, mock, Crypto, yaml, TestCase, int_to_byte, StringIO
+    patch, mock, Crypto, yaml, numpy, TestCase, int_to_byte, StringIO
 )
 from utile import (
     safe_import, encrypt, decrypt, shell_quote, flatten, dir_dict,
     process_name, process_info, get_pid_list, TemporaryDirectory, file_lock,
     requires_commands, resolve, EnforcementError, parse_table, reformat_query,
     raises, countdown, random_text, LazyResolve, swap_save, touch, safe_mkdir,
-    ThrottleFilter, write_file
+    ThrottleFilter, write_file, invalidate_resolve, PathIndex, TableSchema,
+    slicer_by_size, compact_record, record_class, _record_classes,
+    _record_classes_limit
 )
 
 
@@ -56,6 +63,22 @@ class BaseTestCase(TestCase):
         self.assertRaises(ImportError, resolve, 'non_existent_module')
         self.assertRaises(ImportError, resolve, 'sys.non_existent_attribute')
 
+    def test_resolve_cache(self):
+        name = 'utile_resolve_cache_test'
+        with TemporaryDirectory() as tmp:
+            sys.path.insert(0, tmp)
+            try:
+                self.assertEqual(safe_import(name), None)
+                write_file(join(tmp, name + '.py'), 'value = 1\n')
+                self.assertEqual(safe_import(name), None)
+                invalidate_resolve(name)
+                self.assertEqual(resolve(name + '.value'), 1)
+                self.assertIs(resolve(name), sys.modules[name])
+            finally:
+                sys.path.remove(tmp)
+                sys.modules.pop(name, None)
+                invalidate_resolve()
+
     def test_safe_import(self):
         pairs = {
             'os': os,
@@ -78,6 +101,50 @@ class BaseTestCase(TestCase):
         data = dir_dict(Dummy(), only_public=False)
         self.assertTrue('_private' in data)
 
+    def test_dir_dict_compact(self):
+        class Dummy(object):
+            description = 'this is a dummy'
+
+        data = dir_dict(Dummy(), compact=True)
+        self.assertEqual(data.description, 'this is a dummy')
+        self.assertTrue('description' in data)
+        self.assertEqual(data.to_dict(), dict(description='this is a dummy'))
+
+    def test_compact_record(self):
+        record = compact_record([('name', 'one'), ('count', 1), ('a b', 2)])
+        self.assertIs(type(record), record_class(['name', 'count', 'a b']))
+        self.assertEqual(record.name, 'one')
+        self.assertEqual(record['count'], 1)
+        self.assertEqual(record['a b'], 2)
+        self.assertRaises(KeyError, lambda: record['missing'])
+        self.assertEqual(record.get('missing', 3), 3)
+        expected = {'name': 'one', 'count': 1, 'a b': 2}
+        self.assertEqual(record.to_dict(), expected)
+        self.assertEqual(pickle.loads(pickle.dumps(record)), record)
+        self.assertRaises(AttributeError, setattr, record, 'name', 'two')
+
+    def test_compact_record_mapping(self):
+        record = compact_record([('name', 'one'), ('count', 1)])
+        self.assertEqual(list(record), ['name', 'count'])
+        self.assertEqual(len(record), 2)
+        self.assertIn('name', record)
+        self.assertNotIn('one', record)
+        self.assertEqual(dict(record), dict(name='one', count=1))
+        self.assertEqual(record, dict(name='one', count=1))
+        self.assertEqual([dict(name='one', count=1)], [record])
+        self.assertEqual(record, compact_record(count=1, name='one'))
+        self.assertEqual(hash(record),
+                         hash(compact_record(count=1, name='one')))
+        self.assertNotEqual(record, compact_record(title='one', count=1))
+        self.assertNotEqual(record, ('one', 1))
+
+    def test_record_class_cache(self):
+        record = compact_record(name='one')
+        for i in range(_record_classes_limit + 10):
+            record_class(['key%d' % i])
+        self.assertEqual(len(_record_classes), _record_classes_limit)
+        self.assertEqual(record, compact_record(name='one'))
+
     @unittest.skipIf(platform.system() == 'Windows', 'Windows not supported')
     def test_process_name(self):
         self.assertEqual(process_name(1), ['/sbin/init'])
@@ -131,6 +198,40 @@ class BaseTestCase(TestCase):
         with self.assertRaisesRegex(EnforcementError, 'i_dont_exist'):
             requires_commands('i_dont_exist')
 
+    @unittest.skipUnless(mock, 'mock not installed')
+    @unittest.skipIf(platform.system() == 'Windows', 'Windows not supported')
+    def test_path_index(self):
+        with TemporaryDirectory() as tmp:
+            a, b = join(tmp, 'a'), join(tmp, 'b')
+            files = [(join(a, 'tool'), 0o755), (join(b, 'tool'), 0o755),
+                     (join(b, 'data'), 0o644)]
+            for path, mode in files:
+                safe_mkdir(os.path.dirname(path))
+                write_file(path, '')
+                os.chmod(path, mode)
+            os.mkdir(join(a, 'subdir'))
+            for i in [a, b]:
+                os.utime(i, (1000, 1000))
+            index = PathIndex()
+            with patch.dict('os.environ', PATH=os.pathsep.join([a, b, a])):
+                found = index.which_many(['tool', 'data', 'subdir', 'x'])
+                self.assertEqual(found, dict(
+                    tool=[join(a, 'tool'), join(b, 'tool')],
+                    data=[], subdir=[], x=[]))
+                self.assertEqual(index.which_many([join(a, 'tool')]),
+                                 {join(a, 'tool'): [join(a, 'tool')]})
+                self.assertEqual(index.scans, 2)
+                write_file(join(b, 'new'), '')
+                os.chmod(join(b, 'new'), 0o755)
+                os.utime(b, (2000, 2000))
+                self.assertEqual(index.which_many(['new'])['new'],
+                                 [join(b, 'new')])
+                self.assertEqual(index.scans, 3)
+            with patch.dict('os.environ', PATH=b):
+                self.assertEqual(index.which_many(['tool'])['tool'],
+                                 [join(b, 'tool')])
+                self.assertEqual(index.scans, 3)
+
     @unittest.skipUnless(mock, 'mock not installed')
     def test_countdown(self):
         with patch('utile.timer', side_effect=[0, 0, 0, 1, 1, 2, 2]):
@@ -177,6 +278,74 @@ class BaseTestCase(TestCase):
         ]
         self.assertEqual(parse_table(input, yaml=True), output)
 
+    def test_table_schema(self):
+        report = """\
+            ====  ======  =====
+            name  number  color
+            ====  ======  =====
+            zero  0       red
+
+            one   1       green
+            ====  ======  =====
+            trailing text
+        """
+        lines = iter(StringIO(report * 2))
+        schema = TableSchema.from_lines(lines, ['color', 'name'])
+        self.assertEqual(schema.keys, ['color', 'name'])
+        first = [dict(color='red', name='zero'),
+                 dict(color='green', name='one')]
+        self.assertEqual(list(schema.rows(lines)), first)
+        self.assertEqual(next(lines).strip(), 'trailing text')
+        self.assertEqual(list(schema.rows(lines)), first)
+        self.assertEqual(parse_table(report, columns=['number']),
+                         [dict(number='0'), dict(number='1')])
+        self.assertRaisesRegex(ValueError, 'unknown columns: size',
+                               parse_table, report, columns=['size'])
+
+    @unittest.skipUnless(yaml, 'PyYAML not installed')
+    def test_parse_table_typed(self):
+        input = """
+            ====  =====  ==========  =========
+            int   float  date        other
+            ====  =====  ==========  =========
+            1     1.5    2000-01-02  text
+            -2    1e3    2000-01-03  [1, 2]
+            010   ~      12:30       yes
+            ====  =====  ==========  =========
+        """
+        output = dict(
+            int=[1, -2, 8],
+            float=[1.5, '1e3', None],
+            date=[datetime.date(2000, 1, 2), datetime.date(2000, 1, 3), 750],
+            other=['text', [1, 2], True],
+        )
+        self.assertEqual(parse_table(input, True, output='columns'), output)
+        rows = parse_table(input, True, ['int', 'other'])
+        self.assertEqual(rows[2], dict(int=8, other=True))
+        rows = parse_table(input, True, ['int', 'other'], compact=True)
+        self.assertEqual((rows[2].int, rows[2].other), (8, True))
+        self.assertEqual(rows, parse_table(input, True, ['int', 'other']))
+        self.assertRaisesRegex(ValueError, 'unknown output',
+                               parse_table, input, output='x')
+
+    @unittest.skipUnless(yaml and numpy, 'PyYAML or NumPy not installed')
+    def test_parse_table_numpy(self):
+        input = """
+            ====  =====
+            int   float
+            ====  =====
+            1     1.5
+            2     2.5
+            ====  =====
+        """
+        actual = parse_table(input, True, output='numpy')
+        self.assertEqual(actual['int'].dtype.kind, 'i')
+        self.assertEqual(actual['float'].sum(), 4.0)
+
+    def test_slicer_by_size(self):
+        self.assertEqual(slicer_by_size([2, 3, 1])('abcdefg'),
+                         ('ab', 'cde', 'f'))
+
     def test_reformat_query(self):
         class Item(object):
             name = 'Dummy'
@@ -194,6 +363,25 @@ class BaseTestCase(TestCase):
         lazy = LazyResolve(dict(Popen='subprocess.Popen'))
         self.assertEqual(lazy.Popen, Popen)
 
+    def test_lazy_resolve_threads(self):
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.01)
+            return object()
+
+        lazy = LazyResolve(dict(value=slow))
+        results = []
+        threads = [Thread(target=lambda: results.append(lazy.value))
+                   for i in range(8)]
+        for i in threads:
+            i.start()
+        for i in threads:
+            i.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(map(id, results))), 1)
+
     @unittest.skipIf(platform.system() == 'Windows', 'Windows not supported')
     def test_swap_save(self):
         with NamedTemporaryFile(prefix='swap_save_') as f:
@@ -236,3 +424,99 @@ class BaseTestCase(TestCase):
             os.mkdir(old_path)
             filter.filter(None)
             self.assertFalse(exists(old_path))
+
+    @unittest.skipUnless(mock, 'mock not installed')
+    @unittest.skipIf(platform.system() == 'Windows', 'Windows not supported')
+    def test_throttle_filter_counter(self):
+        with TemporaryDirectory() as tmp:
+            filter = ThrottleFilter(tmp, 3, backend='counter')
+            actual = [filter.filter(None) for i in range(5)]
+            self.assertEqual(actual, [1, 1, 1, 0, 0])
+            write_file(join(tmp, 'counter.slots'), 'corrupt')
+            self.assertEqual(filter.filter(None), 1)
+            past = datetime.datetime(2000, 1, 1)
+            with patch('datetime.datetime') as mock_datetime:
+                mock_datetime.now.return_value = past
+                self.assertEqual(filter.filter(None), 1)
+            self.assertRaises(ValueError, ThrottleFilter, tmp, 3, 'hour', 'x')
+            self.assertRaises(ValueError, ThrottleFilter, tmp, 3, mode='x')
+            self.assertRaises(ValueError, ThrottleFilter, tmp, 3,
+                              backend='files', mode='token')
+
+    def throttle_timeline(self, filter, timeline):
+        actual = []
+        for now, count in timeline:
+            with patch('time.time', return_value=now):
+                actual.append([filter.filter(None) for i in range(count)])
+        return actual
+
+    @unittest.skipUnless(mock, 'mock not installed')
+    @unittest.skipIf(platform.system() == 'Windows', 'Windows not supported')
+    def test_throttle_filter_sliding(self):
+        with TemporaryDirectory() as tmp:
+            filter = ThrottleFilter(tmp, 2, period=10, mode='sliding')
+            actual = self.throttle_timeline(
+                filter, [(100, 3), (110, 1), (115, 2), (200, 2)])
+            expected = [[1, 1, 0], [0], [1, 0], [1, 1]]
+            self.assertEqual(actual, expected)
+
+    @unittest.skipIf(platform.system() == 'Windows', 'Windows not supported')
+    def test_throttle_filter_keys(self):
+        def record(msg, name='app'):
+            return logging.makeLogRecord(dict(msg=msg, name=name))
+
+        with TemporaryDirectory() as tmp:
+            filter = ThrottleFilter(tmp, 1, key='message', max_keys=2)
+            actual = [filter.filter(record(i)) for i in 'aabbc']
+            self.assertEqual(actual, [1, 0, 1, 0, 1])
+            self.assertEqual(filter.filter(record('a')), 1)
+            filter = ThrottleFilter(tmp, 1, key='message', max_keys=100)
+            keys = [str(i) for i in range(100)]
+            actual = [filter.filter(record(i)) for i in keys + keys]
+            self.assertEqual(actual, [1] * 100 + [0] * 100)
+            size = os.path.getsize(filter.counter_path)
+            for i in range(200, 400):
+                filter.filter(record(str(i)))
+            self.assertEqual(os.path.getsize(filter.counter_path), size)
+            self.assertEqual(filter.filter(record('399')), 0)
+            self.assertEqual(filter.filter(record('0')), 1)
+            filter = ThrottleFilter(tmp, 1, key=lambda r: r.msg[0])
+            actual = [filter.filter(record(i)) for i in ['x1', 'x2', 'y1']]
+            self.assertEqual(actual, [1, 0, 1])
+            self.assertRaises(ValueError, ThrottleFilter, tmp, 1, key='x')
+
+    @unittest.skipUnless(mock, 'mock not installed')
+    @unittest.skipIf(platform.system() == 'Windows', 'Windows not supported')
+    def test_throttle_filter_summary(self):
+        with TemporaryDirectory() as tmp:
+            filter = ThrottleFilter(tmp, 1, period=10, mode='token',
+                                    key='logger', summary=True)
+            logger = logging.getLogger('utile.test.summary')
+            logger.propagate = False
+            handler = logging.Handler()
+            handler.emit = mock.Mock()
+            handler.addFilter(filter)
+            logger.addHandler(handler)
+            with patch('utile.time') as mock_time:
+                mock_time.time.side_effect = [0, 1, 2, 20]
+                for i in range(4):
+                    logger.error('error %s', i)
+            logger.removeHandler(handler)
+        actual = [i[0][0].getMessage() for i in handler.emit.call_args_list]
+        expected = [
+            'error 0',
+            "2 records suppressed by ThrottleFilter for key "
+            "'utile.test.summary'",
+            'error 3',
+        ]
+        self.assertEqual(actual, expected)
+
+    @unittest.skipUnless(mock, 'mock not installed')
+    @unittest.skipIf(platform.system() == 'Windows', 'Windows not supported')
+    def test_throttle_filter_token(self):
+        with TemporaryDirectory() as tmp:
+            filter = ThrottleFilter(tmp, 2, period=1, mode='token', burst=3)
+            actual = self.throttle_timeline(
+                filter, [(100, 4), (100.5, 2), (110, 4)])
+            expected = [[1, 1, 1, 0], [1, 0], [1, 1, 1, 0]]
+            self.assertEqual(actual, expected)
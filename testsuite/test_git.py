@@ -19,7 +19,7 @@ class GitTestCase(TestCase):
 
     def test_git_describe(self):
         with patch('utile.which', return_value=['/usr/bin/git']):
-            with patch('utile.Popen') as MockPopen:
+            with patch('subprocess.Popen') as MockPopen:
                 proc = MockPopen.return_value
                 proc.communicate.return_value = (b'v0.2-8-gdbc0d9c\n', b'')
                 self.assertEqual(git_version('0.3.dev'), '0.3.dev8')
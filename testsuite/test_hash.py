@@ -0,0 +1,168 @@
+
+import re
+import hashlib
+import unittest
+import os
+from os import makedirs
+from os.path import join
+from io import BytesIO
+from utile import (TemporaryDirectory, write_file, hash_file, hash_dir,
+                   stamp_dir, HashCache, buffered_readinto, buffer_size_for,
+                   iter_hash_dir, iter_stamp_dir, walk_files)
+from testsuite.support import TestCase, patch, mock
+
+FILES = {
+    'a.txt': 'alpha',
+    'b/c.txt': 'charlie',
+    'b/d/e.txt': 'echo' * 5000,
+    'b.txt': '',
+}
+
+
+def md5(data):
+    return hashlib.md5(data.encode('utf8')).hexdigest()
+
+
+class HashTestCase(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.dir = self.tmp.__enter__()
+        makedirs(join(self.dir, 'b', 'd'))
+        for name, data in FILES.items():
+            write_file(join(self.dir, name), data)
+        self.expected = ''.join(
+            '{0}  ./{1}\n'.format(md5(FILES[i]), i)
+            for i in ['a.txt', 'b/c.txt', 'b/d/e.txt', 'b.txt']
+        )
+
+    def tearDown(self):
+        self.tmp.__exit__(None, None, None)
+
+    def test_hash_file(self):
+        path = join(self.dir, 'b/d/e.txt')
+        self.assertEqual(hash_file(path).hexdigest(), md5(FILES['b/d/e.txt']))
+        actual = hash_file(path, 'sha256').hexdigest()
+        expected = hashlib.sha256(FILES['b/d/e.txt'].encode('utf8'))
+        self.assertEqual(actual, expected.hexdigest())
+
+    def test_hash_file_modes(self):
+        for name, data in FILES.items():
+            for mode in ['read', 'readinto', 'mmap']:
+                actual = hash_file(join(self.dir, name), mode=mode)
+                self.assertEqual(actual.hexdigest(), md5(data))
+
+    def test_hash_file_many(self):
+        path = join(self.dir, 'a.txt')
+        hashes = hash_file(path, ['md5', 'sha256'])
+        self.assertEqual(sorted(hashes), ['md5', 'sha256'])
+        self.assertEqual(hashes['md5'].hexdigest(), md5('alpha'))
+        expected = hashlib.sha256(b'alpha').hexdigest()
+        self.assertEqual(hashes['sha256'].hexdigest(), expected)
+
+    def test_buffered_readinto(self):
+        chunks = []
+        data = BytesIO(b'0123456789')
+        buffered_readinto(data.readinto, lambda x: chunks.append(bytes(x)), 4)
+        self.assertEqual(chunks, [b'0123', b'4567', b'89'])
+
+    def test_buffer_size_for(self):
+        self.assertEqual(buffer_size_for(0), 4 * 1024)
+        self.assertEqual(buffer_size_for(10000), 10001)
+        self.assertEqual(buffer_size_for(10 ** 10), 1024 * 1024)
+
+    def test_hash_dir(self):
+        self.assertEqual(hash_dir(self.dir), self.expected)
+
+    def test_hash_dir_threads(self):
+        self.assertEqual(hash_dir(self.dir, workers=4), self.expected)
+
+    def test_hash_dir_processes(self):
+        actual = hash_dir(self.dir, workers=2, executor='process')
+        self.assertEqual(actual, self.expected)
+
+    def test_iter_hash_dir(self):
+        lines = iter_hash_dir(self.dir, workers=2)
+        self.assertEqual(next(lines), self.expected.splitlines(True)[0])
+        self.assertEqual(''.join(lines), ''.join(
+            self.expected.splitlines(True)[1:]))
+
+    def test_walk_files(self):
+        os.symlink(join(self.dir, 'b'), join(self.dir, 'link'))
+        names = [name for entry, name in walk_files(self.dir)]
+        expected = ['a.txt', 'b/c.txt', 'b/d/e.txt', 'b.txt']
+        self.assertEqual(names, [i.replace('/', os.sep) for i in expected])
+
+    def test_walk_files_filters(self):
+        def names(**kwargs):
+            return [name.replace(os.sep, '/')
+                    for entry, name in walk_files(self.dir, **kwargs)]
+
+        self.assertEqual(names(include='*.txt', exclude='d'),
+                         ['a.txt', 'b/c.txt', 'b.txt'])
+        self.assertEqual(names(exclude=['b/d', 'a.*']), ['b/c.txt', 'b.txt'])
+        self.assertEqual(names(include=re.compile('^b/')),
+                         ['b/c.txt', 'b/d/e.txt'])
+
+    @unittest.skipUnless(mock, 'mock not installed')
+    def test_walk_files_pruning(self):
+        with patch('os.scandir', side_effect=os.scandir) as mock_scandir:
+            list(walk_files(self.dir, exclude='b'))
+        self.assertEqual(mock_scandir.call_count, 1)
+
+    def test_hash_dir_many(self):
+        actual = hash_dir(self.dir, ['md5', 'sha1'], workers=2)
+        self.assertEqual(actual['md5'], self.expected)
+        self.assertEqual(actual['sha1'], hash_dir(self.dir, 'sha1'))
+
+    def test_hash_cache_racy(self):
+        cache = HashCache(join(self.dir, 'cache.json'))
+        path = join(self.dir, 'b', 'c.txt')
+        hash_dir(join(self.dir, 'b'), cache=cache)
+        self.assertEqual(cache.entries, {})
+        stat = os.stat(path)
+        write_file(path, 'CHARLIE')
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        actual = hash_dir(join(self.dir, 'b'), cache=cache)
+        self.assertIn(md5('CHARLIE'), actual)
+        self.assertEqual(cache.hits, 0)
+
+    def test_hash_dir_cache(self):
+        path = join(self.dir, 'cache.json')
+        cache = HashCache(path)
+        cache_dir = join(self.dir, 'b')
+        for i in ['c.txt', join('d', 'e.txt')]:
+            os.utime(join(cache_dir, i), (1000, 1000))
+        expected = hash_dir(cache_dir)
+        self.assertEqual(hash_dir(cache_dir, cache=cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        cache = HashCache(path)
+        self.assertEqual(hash_dir(cache_dir, cache=cache), expected)
+        self.assertEqual((cache.hits, cache.misses), (2, 0))
+        write_file(join(cache_dir, 'c.txt'), 'changed data')
+        os.utime(join(cache_dir, 'c.txt'), (2000, 2000))
+        os.remove(join(cache_dir, 'd', 'e.txt'))
+        actual = hash_dir(cache_dir, cache=cache)
+        self.assertEqual(actual, '{0}  ./c.txt\n'.format(md5('changed data')))
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        self.assertEqual(cache.evictions, 1)
+        self.assertEqual(sorted(HashCache(path).entries), ['c.txt'])
+        hash_dir(cache_dir, ['md5', 'sha1'], cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (2, 2))
+        hash_dir(cache_dir, ['md5', 'sha1'], cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (3, 2))
+
+    def test_stamp_dir(self):
+        lines = stamp_dir(self.dir).splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[0].split()[:2], [join(self.dir, 'a.txt'), '5'])
+        format = '{file.name}\n'
+        self.assertEqual(list(iter_stamp_dir(self.dir, format)),
+                         ['a.txt\n', 'c.txt\n', 'e.txt\n', 'b.txt\n'])
+        actual = stamp_dir(self.dir, format, exclude='b')
+        self.assertEqual(actual, 'a.txt\nb.txt\n')
+
+    def test_hash_dir_filters(self):
+        actual = hash_dir(self.dir, include='*.txt', exclude='d')
+        lines = self.expected.splitlines(True)
+        expected = [i for i in lines if 'e.txt' not in i]
+        self.assertEqual(actual, ''.join(expected))
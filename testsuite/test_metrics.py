@@ -0,0 +1,60 @@
+
+import unittest
+from os.path import join
+from utile import Metrics, metrics, TemporaryDirectory, swap_save, wait
+from testsuite.support import patch, mock, TestCase, read_file
+
+EXPECTED = """\
+# TYPE jobs_total counter
+jobs_total 3
+jobs_total{queue="a\\"b"} 1
+# TYPE workers gauge
+workers 4
+# TYPE latency_seconds histogram
+latency_seconds_bucket{le="0.1"} 1
+latency_seconds_bucket{le="1"} 2
+latency_seconds_bucket{le="+Inf"} 3
+latency_seconds_sum 5.55
+latency_seconds_count 3
+"""
+
+
+class MetricsTestCase(TestCase):
+    def test_render(self):
+        registry = Metrics(enabled=True, buckets=(0.1, 1))
+        registry.inc('jobs_total')
+        registry.inc('jobs_total', 2)
+        registry.inc('jobs_total', queue='a"b')
+        registry.set('workers', 4)
+        for i in [0.05, 0.5, 5]:
+            registry.observe('latency_seconds', i)
+        self.assertEqual(registry.render(), EXPECTED)
+        registry.reset()
+        self.assertEqual(registry.render(), '')
+
+    def test_export(self):
+        registry = Metrics()
+        registry.set('workers', 1)
+        with TemporaryDirectory() as tmp:
+            path = join(tmp, 'utile.prom')
+            registry.export(path)
+            self.assertEqual(read_file(path), '# TYPE workers gauge\n'
+                                              'workers 1\n')
+
+    @unittest.skipUnless(mock, 'mock not installed')
+    def test_instrumented(self):
+        with patch.object(metrics, 'enabled', True):
+            with TemporaryDirectory() as tmp:
+                swap_save(join(tmp, 'test.txt'), 'data')
+                self.assertRaises(TypeError, wait, callable=None)
+            text = metrics.render()
+            metrics.reset()
+        self.assertIn('utile_swap_save_calls_total 1\n', text)
+        self.assertIn('utile_swap_save_duration_seconds_count 1\n', text)
+        self.assertIn('utile_wait_errors_total 1\n', text)
+
+    def test_disabled(self):
+        self.assertFalse(metrics.enabled)
+        with TemporaryDirectory() as tmp:
+            swap_save(join(tmp, 'test.txt'), 'data')
+        self.assertEqual(metrics.render(), '')
@@ -0,0 +1,87 @@
+
+import json
+import unittest
+from threading import Thread
+from utile import Profiler, timed
+from testsuite.support import patch, mock, TestCase, StringIO
+
+
+@unittest.skipUnless(mock, 'mock not installed')
+@patch('utile.timer', side_effect=range(100))
+class ProfilerTestCase(TestCase):
+    def setUp(self):
+        self.profiler = Profiler()
+
+    def test_nested_sections(self, mock_timer):
+        with self.profiler.section('main'):
+            for i in range(2):
+                with self.profiler.section('load'):
+                    pass
+        report = self.profiler.report()
+        self.assertEqual(sorted(report), ['main', 'main;load'])
+        self.assertEqual(report['main']['count'], 1)
+        self.assertEqual(report['main']['total'], 5)
+        load = report['main;load']
+        self.assertEqual((load['count'], load['total']), (2, 2))
+        self.assertEqual((load['min'], load['max'], load['p50']), (1, 1, 1))
+        expected = 'main 3000000\nmain;load 2000000\n'
+        self.assertEqual(self.profiler.collapsed(), expected)
+
+    def test_decorator(self, mock_timer):
+        @self.profiler.section('work')
+        def work(x):
+            return x * 2
+
+        self.assertEqual([work(1), work(2)], [2, 4])
+        self.assertEqual(self.profiler.report()['work']['count'], 2)
+        self.assertEqual(work.__name__, 'work')
+
+    def test_recursive_section(self, mock_timer):
+        @self.profiler.section('fib')
+        def fib(n):
+            return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+        self.assertEqual(fib(3), 2)
+        report = self.profiler.report()
+        self.assertEqual(sorted(report), ['fib', 'fib;fib', 'fib;fib;fib'])
+        self.assertEqual(report['fib;fib']['count'], 2)
+        self.assertIs(self.profiler.section('fib'),
+                      self.profiler.section('fib'))
+
+    def test_to_json(self, mock_timer):
+        with self.profiler.section('main'):
+            pass
+        data = json.loads(self.profiler.to_json())
+        self.assertEqual(data['main']['count'], 1)
+        self.profiler.reset()
+        self.assertEqual(self.profiler.report(), {})
+
+    def test_timed(self, mock_timer):
+        with patch('sys.stdout', new_callable=StringIO) as mock_stdout:
+            with timed('step', self.profiler):
+                pass
+        self.assertEqual(mock_stdout.getvalue(), '')
+        self.assertEqual(self.profiler.report()['step']['total'], 1)
+
+    def test_threads(self, mock_timer):
+        def worker(name):
+            with self.profiler.section(name):
+                with self.profiler.section('child'):
+                    pass
+
+        threads = [Thread(target=worker, args=(i,)) for i in 'ab']
+        for i in threads:
+            i.start()
+        for i in threads:
+            i.join()
+        report = self.profiler.report()
+        self.assertEqual(sorted(report), ['a', 'a;child', 'b', 'b;child'])
+
+    def test_percentiles(self, mock_timer):
+        profiler = Profiler(samples=10)
+        for i in range(1, 101):
+            profiler.record('x', i)
+        report = profiler.report(percentiles=[0, 100])['x']
+        self.assertEqual(report['count'], 100)
+        self.assertEqual((report['min'], report['max']), (1, 100))
+        self.assertTrue(1 <= report['p0'] <= report['p100'] <= 100)
@@ -2,10 +2,12 @@
 import unittest
 from os.path import exists
 from tempfile import NamedTemporaryFile
-from utile import shell
+from utile import shell, async_shell, safe_import, shell_many, stream_call
 from subprocess import CalledProcessError
 from testsuite.support import patch, mock, read_file, TestCase, StringIO
 
+asyncio = safe_import('asyncio')
+
 
 @unittest.skipUnless(mock, 'mock not installed')
 @unittest.skipUnless(exists('/bin/echo'), '/bin/echo not found')
@@ -45,3 +47,112 @@ class ShellTestCase(TestCase):
     def test_strict_call_with_value_error(self, mock_stdout):
         with self.assertRaises(ValueError):
             shell(self.invalid, strict=True, shell=False)
+
+    def test_stream_call(self, mock_stdout):
+        lines = []
+        cmd = '/bin/echo out; /bin/echo err >&2; /bin/echo done'
+
+        def callback(name, line):
+            lines.append((name, line))
+
+        self.assertEqual(shell(cmd, caller=stream_call, callback=callback), 0)
+        self.assertEqual(sorted(lines), [
+            ('stderr', 'err\n'), ('stdout', 'done\n'), ('stdout', 'out\n')])
+        self.assertEqual(lines.index(('stdout', 'out\n')), 0)
+
+    def test_stream_call_default_output(self, mock_stdout):
+        shell(self.hello, caller=stream_call)
+        self.assertIn('hello\n', mock_stdout.getvalue())
+
+    def test_stream_call_tail(self, mock_stdout):
+        cmd = 'for i in $(seq 1000); do /bin/echo line$i; done; exit 2'
+        with self.assertRaises(CalledProcessError) as context:
+            shell(cmd, caller=stream_call, callback=lambda *args: None,
+                  tail=3)
+        self.assertEqual(context.exception.returncode, 2)
+        self.assertEqual(context.exception.output,
+                         'line998\nline999\nline1000\n')
+
+    def test_shell_many(self, mock_stdout):
+        cmds = ['/bin/echo one', '/bin/echo two; /bin/echo three']
+        results = shell_many(cmds, max_workers=2)
+        self.assertEqual([i['output'] for i in results],
+                         ['one\n', 'two\nthree\n'])
+        self.assertEqual([i['returncode'] for i in results], [0, 0])
+        output = mock_stdout.getvalue()
+        self.assertIn('[1] two\n[1] three\n', output)
+        self.assertEqual(output.count('duration: '), 2)
+
+    def test_shell_many_collect_all(self, mock_stdout):
+        cmds = dict(good=self.hello, bad='exit 3', strict=self.invalid)
+        with self.assertRaises(CalledProcessError) as context:
+            shell_many(cmds, strict=True)
+        results = dict((i['name'], i['returncode'])
+                       for i in context.exception.results)
+        self.assertEqual(results, dict(good=0, bad=3, strict=127))
+        self.assertIn('[strict] /bin/bash: ', mock_stdout.getvalue())
+
+    def test_shell_many_fail_fast(self, mock_stdout):
+        cmds = ['exit 1'] + ['sleep 5'] * 3
+        with self.assertRaises(CalledProcessError) as context:
+            shell_many(cmds, max_workers=2, fail_fast=True)
+        results = context.exception.results
+        self.assertEqual(results[0]['returncode'], 1)
+        self.assertIsNone(results[-1])
+        for i in results[1:]:
+            self.assertTrue(i is None or i['returncode'] < 0)
+
+    def test_shell_many_fail_fast_names_failed(self, mock_stdout):
+        with self.assertRaises(CalledProcessError) as context:
+            shell_many(['sleep 5', 'exit 7'], max_workers=2, fail_fast=True)
+        self.assertEqual(context.exception.returncode, 7)
+        self.assertEqual(context.exception.results[0]['returncode'], -9)
+
+
+@unittest.skipUnless(mock, 'mock not installed')
+@unittest.skipUnless(asyncio, 'asyncio not available')
+@unittest.skipUnless(exists('/bin/echo'), '/bin/echo not found')
+@unittest.skipUnless(exists('/bin/bash'), '/bin/bash not found')
+@patch('sys.stdout', new_callable=StringIO)
+class AsyncShellTestCase(TestCase):
+    hello = '/bin/echo hello'
+    invalid = 'invalid_command;/bin/echo hello'
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def run_shell(self, *args, **kwargs):
+        return self.loop.run_until_complete(async_shell(*args, **kwargs))
+
+    def test_basic(self, mock_stdout):
+        with NamedTemporaryFile() as out:
+            self.assertEqual(self.run_shell(self.hello, stdout=out), 0)
+            self.assertEqual(read_file(out.name), 'hello\n')
+        self.assertIn('duration: ', mock_stdout.getvalue())
+
+    def test_verbose_with_strict(self, mock_stdout):
+        with NamedTemporaryFile() as out, NamedTemporaryFile() as err:
+            self.run_shell(self.hello, stdout=out, stderr=err, verbose=True,
+                           strict=True)
+            self.assertEqual(read_file(err.name).strip(), self.hello)
+
+    def test_many_commands_with_strict(self, mock_stdout):
+        with NamedTemporaryFile() as out, NamedTemporaryFile() as err:
+            with self.assertRaises(CalledProcessError):
+                self.run_shell(self.invalid, stdout=out, stderr=err,
+                               strict=True)
+
+    def test_no_shell(self, mock_stdout):
+        with NamedTemporaryFile() as out:
+            cmd = ['/bin/echo', 'hello']
+            self.assertEqual(self.run_shell(cmd, stdout=out, shell=False), 0)
+            self.assertEqual(read_file(out.name), 'hello\n')
+
+    def test_strict_call_with_value_error(self, mock_stdout):
+        with self.assertRaises(ValueError):
+            async_shell(self.invalid, strict=True, shell=False)
@@ -1,8 +1,18 @@
 
+import os
+import platform
 import unittest
-from utile import wait, wait_false, TimeoutError
+from os.path import join
+from threading import Timer
+from utile import (wait, wait_false, TimeoutError, Backoff, async_wait,
+                   async_wait_false, safe_import, _wait_base, wait_all,
+                   wait_any, wait_for_path, wait_for_change,
+                   TemporaryDirectory, write_file)
 from testsuite.support import patch, mock, TestCase
 
+asyncio = safe_import('asyncio')
+LINUX = platform.system() == 'Linux'
+
 
 @unittest.skipUnless(mock, 'mock not installed')
 @patch('time.sleep')
@@ -23,3 +33,156 @@ class WaitTestCase(TestCase):
 
     def test_wait_false(self, mock_timer, mock_sleep):
         self.assertFalse(wait_false(callable=self.checker))
+
+    def test_deadline(self, mock_timer, mock_sleep):
+        self.assertRaises(TimeoutError, wait, 5, 10, self.checker)
+        expected = [mock.call(3), mock.call(1)]
+        self.assertEqual(mock_sleep.call_args_list, expected)
+
+    def test_backoff(self, mock_timer, mock_sleep):
+        backoff = Backoff(1, factor=2, max_delay=5)
+        self.assertTrue(wait(None, backoff, self.checker))
+        delays = [i[0][0] for i in mock_sleep.call_args_list]
+        self.assertEqual(delays, [1, 2, 4] + [5] * 7)
+        self.assertEqual(backoff.attempts, 11)
+        self.assertEqual(backoff.predicate_time, 11)
+        self.assertEqual(backoff.sleep_time, sum(delays))
+        # each wait runs on a copy, so the shared instance keeps its delays
+        self.assertEqual(backoff.current, 1)
+
+    def test_backoff_without_getargspec(self, mock_timer, mock_sleep):
+        # inspect.getargspec was removed in Python 3.11
+        with patch('inspect.getargspec', side_effect=AttributeError,
+                   create=True):
+            self.assertTrue(wait(None, 1, self.checker))
+            self.assertEqual(Backoff(2, max_delay=3).max_delay, 3)
+
+    def test_backoff_jitter(self, mock_timer, mock_sleep):
+        backoff = Backoff(1, factor=1, jitter=0.5)
+        delays = [backoff.next_delay() for i in range(100)]
+        self.assertTrue(all(0.5 <= i <= 1.5 for i in delays))
+        self.assertNotEqual(len(set(delays)), 1)
+
+    def test_wait_all(self, mock_timer, mock_sleep):
+        fast = mock.Mock(side_effect=[0, 'fast'])
+        actual = wait_all(dict(slow=self.checker, fast=fast))
+        self.assertEqual(actual, dict(slow=True, fast='fast'))
+        self.assertEqual(fast.call_count, 2)
+        self.assertEqual(self.checker.call_count, 11)
+
+    def test_wait_all_list(self, mock_timer, mock_sleep):
+        actual = wait_all([lambda: 1, self.checker], 50)
+        self.assertEqual(actual, [1, True])
+
+    def test_wait_all_timed_out(self, mock_timer, mock_sleep):
+        conditions = dict(ready=lambda: True, slow=self.checker)
+        with self.assertRaisesRegex(TimeoutError, "pending: \\['slow'\\]"):
+            wait_all(conditions, 5)
+
+    def test_wait_any(self, mock_timer, mock_sleep):
+        conditions = dict(slow=self.checker, never=lambda: False)
+        self.assertEqual(wait_any(conditions), ('slow', True))
+        with self.assertRaises(TimeoutError) as context:
+            wait_any(dict(never=lambda: False), 5)
+        self.assertEqual(context.exception.pending, ['never'])
+
+    def test_wait_any_empty(self, mock_timer, mock_sleep):
+        for conditions in [[], {}]:
+            self.assertRaises(ValueError, wait_any, conditions)
+        self.assertRaises(ValueError, wait_any, iter([]))
+        self.assertEqual(wait_any(i for i in [lambda: 0, lambda: 1]), (1, 1))
+        self.assertEqual(wait_all([]), [])
+
+
+@unittest.skipUnless(mock, 'mock not installed')
+@unittest.skipUnless(asyncio, 'asyncio not available')
+class AsyncWaitTestCase(TestCase):
+    def setUp(self):
+        self.checker = mock.Mock(side_effect=[False] * 10 + [True])
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def resolved(self, value):
+        future = self.loop.create_future()
+        future.set_result(value)
+        return future
+
+    def run_wait(self, future):
+        return self.loop.run_until_complete(future)
+
+    def test_async_wait(self):
+        self.assertTrue(self.run_wait(async_wait(1, 0.001, self.checker)))
+        self.assertEqual(self.checker.call_count, 11)
+
+    def test_async_wait_false(self):
+        future = async_wait_false(1, 0.001, self.checker)
+        self.assertFalse(self.run_wait(future))
+
+    def test_async_wait_coroutine(self):
+        values = iter([0, 0, 'ready'])
+        future = async_wait(1, 0.001, lambda: self.resolved(next(values)))
+        self.assertEqual(self.run_wait(future), 'ready')
+
+    def test_async_wait_backoff(self):
+        backoff = Backoff(0.001, max_delay=0.002)
+        self.assertTrue(self.run_wait(async_wait(1, backoff, self.checker)))
+        self.assertEqual(backoff.attempts, 11)
+
+    def test_async_timed_out(self):
+        with self.assertRaises(TimeoutError):
+            self.run_wait(async_wait(0.01, 0.001, lambda: False))
+
+    def test_async_error(self):
+        with self.assertRaises(ZeroDivisionError):
+            self.run_wait(async_wait(1, 0.001, lambda: 1 / 0))
+
+
+@unittest.skipUnless(mock, 'mock not installed')
+class WaitForPathTestCase(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.path = join(self.tmp.__enter__(), 'ready.txt')
+
+    def tearDown(self):
+        self.tmp.__exit__(None, None, None)
+
+    def later(self, func, *args):
+        timer = Timer(0.05, func, args)
+        timer.start()
+        self.addCleanup(timer.join)
+
+    def check_path(self, delay):
+        self.later(write_file, self.path, 'data')
+        self.assertTrue(wait_for_path(self.path, 5, delay=delay))
+        self.later(os.remove, self.path)
+        self.assertTrue(wait_for_path(self.path, 5, exists=False, delay=delay))
+        self.assertRaises(TimeoutError, wait_for_path, self.path, 0.01)
+
+    def check_change(self, delay):
+        write_file(self.path, 'data')
+        self.later(write_file, self.path, 'changed data')
+        self.assertTrue(wait_for_change(self.path, 5, delay=delay))
+        self.assertRaises(TimeoutError, wait_for_change, self.path, 0.01)
+
+    @unittest.skipUnless(LINUX, 'inotify requires Linux')
+    def test_wait_for_path(self):
+        with patch('utile._wait_base') as mock_wait_base:
+            self.check_path(delay=10)
+        self.assertFalse(mock_wait_base.called)
+
+    @unittest.skipUnless(LINUX, 'inotify requires Linux')
+    def test_wait_for_change(self):
+        with patch('utile._wait_base') as mock_wait_base:
+            self.check_change(delay=10)
+        self.assertFalse(mock_wait_base.called)
+
+    def test_polling_fallback(self):
+        with patch('utile.Inotify', side_effect=OSError):
+            with patch('utile._wait_base', wraps=_wait_base) as mock_wait_base:
+                self.check_path(delay=0.01)
+                self.check_change(delay=0.01)
+        self.assertEqual(mock_wait_base.call_count, 5)
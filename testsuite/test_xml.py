@@ -1,6 +1,8 @@
 
-from utile import pretty_xml, xml_to_dict, element_to_dict
-from testsuite.support import etree, TestCase
+from io import BytesIO
+from utile import (pretty_xml, xml_to_dict, element_to_dict, iter_xml_to_dict,
+                   xml_to_dict_many, pretty_xml_many)
+from testsuite.support import etree, patch, mock, TestCase
 import unittest
 
 XML_DATA = "<html><body><h1>test1</h1><h2>test2</h2></body></html>"
@@ -13,6 +15,14 @@ XML_PRETTY = """\
 </html>
 """
 XML_DICT = {'body': {'h2': 'test2', 'h1': 'test1'}}
+XML_RECORDS = b"""\
+<export>
+  <meta><created>today</created></meta>
+  <item><id>1</id><name>one</name></item>
+  <item><id>2</id><name>two</name></item>
+  <item><id>3</id><name>three</name></item>
+</export>
+"""
 
 
 @unittest.skipUnless(etree, 'lxml not installed')
@@ -25,3 +35,69 @@ class XMLTestCase(TestCase):
 
     def test_xml_to_dict(self):
         self.assertEqual(xml_to_dict(XML_DATA), XML_DICT)
+
+    def test_xml_to_dict_compact(self):
+        actual = xml_to_dict(XML_DATA, compact=True)
+        self.assertEqual((actual.body.h1, actual.body.h2), ('test1', 'test2'))
+        self.assertEqual(actual.body.to_dict(), XML_DICT['body'])
+
+    def test_element_to_dict_deep(self):
+        root = leaf = etree.Element('root')
+        for i in range(5000):
+            leaf = etree.SubElement(leaf, 'node')
+        leaf.text = 'bottom'
+        actual = element_to_dict(root)
+        for i in range(4999):
+            actual = actual['node']
+        self.assertEqual(actual, {'node': 'bottom'})
+        self.assertEqual(element_to_dict(leaf, True), ('node', 'bottom'))
+
+    def test_iter_xml_to_dict(self):
+        items = iter_xml_to_dict(BytesIO(XML_RECORDS), 'item')
+        self.assertEqual(list(items), [
+            {'id': '1', 'name': 'one'},
+            {'id': '2', 'name': 'two'},
+            {'id': '3', 'name': 'three'},
+        ])
+
+    def test_iter_xml_to_dict_nested(self):
+        xml = (b'<r><item><id>1</id><item><id>2</id></item></item>'
+               b'<item><id>3</id></item></r>')
+        items = iter_xml_to_dict(BytesIO(xml), 'item')
+        self.assertEqual(list(items), [
+            {'id': '2'},
+            {'id': '1', 'item': {'id': '2'}},
+            {'id': '3'},
+        ])
+
+    @unittest.skipUnless(mock, 'mock not installed')
+    def test_iter_xml_to_dict_clears(self):
+        parents, sizes = [], []
+
+        def convert(elem):
+            parents.append(elem.getparent())
+            sizes.append(len(elem.getparent()))
+            return element_to_dict(elem)
+
+        items = b''.join(b'<item><id>%d</id></item>' % i for i in range(20000))
+        source = BytesIO(b'<export>' + items + b'</export>')
+        with patch('utile.element_to_dict', convert):
+            records = list(iter_xml_to_dict(source, 'item'))
+        self.assertEqual(len(records), 20000)
+        # only elements read ahead by the parser are still in memory
+        self.assertLess(max(sizes), 2000)
+        self.assertEqual(len(parents[0]), 1)
+        self.assertEqual(len(parents[0][0]), 0)
+
+    def test_xml_to_dict_many(self):
+        xmls = [XML_DATA, '<broken>', XML_DATA.replace('test1', 'other')]
+        for executor in ['thread', 'process']:
+            actual = xml_to_dict_many(xmls, 2, executor, chunksize=1)
+            self.assertEqual(actual[0], XML_DICT)
+            self.assertIsInstance(actual[1], ValueError)
+            self.assertIn('XMLSyntaxError', str(actual[1]))
+            self.assertEqual(actual[2]['body']['h1'], 'other')
+
+    def test_pretty_xml_many(self):
+        actual = pretty_xml_many([XML_DATA] * 10, 2)
+        self.assertEqual(actual, [XML_PRETTY] * 10)
@@ -3,42 +3,30 @@
 # license: BSD, see LICENSE for more details.
 
 from __future__ import print_function
-import hashlib
 import time
-import re
 import os
 import errno
 import os.path
 import sys
-import string
-import random
 import itertools
 from timeit import default_timer as timer
 from functools import wraps
-from shutil import rmtree
-from hashlib import sha256
-from tempfile import mkdtemp, NamedTemporaryFile
-from contextlib import contextmanager
-from datetime import datetime, timedelta
-from textwrap import dedent
-from operator import itemgetter
-from math import log10
-from subprocess import check_call, Popen, PIPE
-from inspect import getargspec
-from argparse import (
-    ArgumentParser, ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter
-)
+from threading import Event, Lock, RLock, Thread, local
+from contextlib import contextmanager, closing
+from collections import deque, OrderedDict
+from operator import itemgetter, attrgetter
 
 __version__ = '0.4.dev'
 PY3 = sys.version_info[0] == 3
 string_types = str if PY3 else basestring
 get_ident = __import__('_thread' if PY3 else 'thread').get_ident
 _builtin_print = print
-alpha_numeric = string.ascii_letters + string.digits
+alpha_numeric = ('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+                 '0123456789')
 
 
 def random_text(length, characters=alpha_numeric):
-    return ''.join(random.choice(characters) for i in range(length))
+    return ''.join(_lazy.random.choice(characters) for i in range(length))
 
 
 # print(*objects, sep=' ', end='\n', file=sys.stdout, flush=False)
@@ -56,7 +44,7 @@ def force_print(*args, **kwargs):
 def countdown(length, msg='Countdown', delay=0.1):
     start = timer()
     maxlen = 0
-    template = '{msg}: {remaining:.%df}' % -log10(delay)
+    template = '{msg}: {remaining:.%df}' % -_lazy.math.log10(delay)
     while timer() - start < length:
         remaining = (start + length) - timer()
         text = template.format(msg=msg, remaining=remaining)
@@ -66,11 +54,9 @@ def countdown(length, msg='Countdown', delay=0.1):
     print('{msg}: done'.format(msg=msg).ljust(maxlen))
 
 
-def resolve(obj):
-    if callable(obj):
-        return obj()
+def _resolve(name):
     item, module = None, []
-    for i in obj.split('.'):
+    for i in name.split('.'):
         module.append(i)
         try:
             item = getattr(item, i)
@@ -83,14 +69,57 @@ def resolve(obj):
     return item
 
 
+# resolve results by name, (True, object) or (False, import error message)
+_resolved = {}
+_resolve_lock = RLock()
+
+
+def resolve(obj):
+    if callable(obj):
+        return obj()
+    try:
+        found, item = _resolved[obj]
+    except KeyError:
+        with _resolve_lock:
+            if obj not in _resolved:
+                try:
+                    _resolved[obj] = True, _resolve(obj)
+                except ImportError as e:
+                    _resolved[obj] = False, str(e)
+            found, item = _resolved[obj]
+    if not found:
+        raise ImportError(item)
+    return item
+
+
+def invalidate_resolve(*names):
+    """
+    Forget cached resolve results for names, or for all names when none are
+    given. Call it after installing a package that was previously missing.
+    """
+    with _resolve_lock:
+        for i in names or list(_resolved):
+            _resolved.pop(i, None)
+    invalidate_caches = getattr(_lazy.importlib, 'invalidate_caches', None)
+    if invalidate_caches:
+        invalidate_caches()
+
+
 class LazyResolve(object):
     def __init__(self, lookup=None):
         self.lookup = lookup or dict()
+        self._lock = RLock()
 
     def __getattr__(self, name):
-        obj = resolve(self.lookup.get(name, name))
-        setattr(self, name, obj)
-        return obj
+        with self._lock:
+            if name not in self.__dict__:
+                obj = resolve(self.lookup.get(name, name))
+                setattr(self, name, obj)
+        return self.__dict__[name]
+
+
+# standard library modules that are only imported on first use
+_lazy = LazyResolve(dict(ctypes_util='ctypes.util'))
 
 
 def safe_import(name, default=None):
@@ -105,63 +134,408 @@ def bunch_or_dict(*args, **kwargs):
     return _class(*args, **kwargs)
 
 
-def dir_dict(obj, default=None, only_public=True):
+class Record(tuple):
+    """
+    Base class of the compact records made by record_class. Like a
+    namedtuple it stores only its values, but it behaves as a read-only
+    mapping: iteration, in, len, == and record[key] work on keys as they do
+    for a dict, and values can also be read as attributes like a Bunch.
+    to_dict converts a record back to bunch_or_dict. As records are tuples,
+    json.dumps writes them as arrays of values, so convert them with
+    to_dict first to get objects.
+    """
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+
+    def __new__(cls, values):
+        return tuple.__new__(cls, values)
+
+    def __getitem__(self, key):
+        return tuple.__getitem__(self, self._index[key])
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __eq__(self, other):
+        if isinstance(other, Record) and self._fields == other._fields:
+            return tuple.__eq__(self, other)
+        if hasattr(other, 'keys'):
+            return dict(self.items()) == dict(other.items())
+        # a plain tuple would otherwise compare equal to the values
+        return False
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(frozenset(self.items()))
+
+    def __reduce__(self):
+        return _make_record, (self._fields, tuple(self.values()))
+
+    def __repr__(self):
+        items = ', '.join('%s=%r' % i for i in self.items())
+        return 'Record(%s)' % items
+
+    def get(self, key, default=None):
+        if key in self._index:
+            return tuple.__getitem__(self, self._index[key])
+        return default
+
+    def keys(self):
+        return list(self._fields)
+
+    def values(self):
+        return list(tuple.__iter__(self))
+
+    def items(self):
+        return list(zip(self._fields, tuple.__iter__(self)))
+
+    def to_dict(self):
+        return bunch_or_dict(self.items())
+
+
+def _record_attribute(index):
+    # record[index] looks up keys, so read the tuple slot directly
+    return property(lambda self: tuple.__getitem__(self, index))
+
+
+# Record classes by their tuple of keys, dropping the oldest past the
+# limit so documents with ever new key sets don't grow it without bound
+_record_classes = OrderedDict()
+_record_classes_limit = 1000
+
+
+def record_class(keys):
+    """
+    Return the Record subclass for keys, creating it on first use. Keys that
+    are identifiers and don't clash with tuple or Record attributes can be
+    read as attributes.
+    """
+    keys = tuple(keys)
+    cls = _record_classes.get(keys)
+    if cls is None:
+        while len(_record_classes) >= _record_classes_limit:
+            try:
+                _record_classes.popitem(last=False)
+            except KeyError:
+                break
+        attrs = dict(__slots__=(), _fields=keys,
+                     _index=dict((j, i) for i, j in enumerate(keys)))
+        for i, key in enumerate(keys):
+            if (isinstance(key, string_types) and not hasattr(Record, key)
+                    and _lazy.re.match('[A-Za-z_][A-Za-z0-9_]*$', key)):
+                attrs[key] = _record_attribute(i)
+        cls = _record_classes.setdefault(keys,
+                                         type('Record', (Record,), attrs))
+    return cls
+
+
+def _make_record(keys, values):
+    return record_class(keys)(values)
+
+
+def compact_record(*args, **kwargs):
+    """
+    Build a Record from the same arguments bunch_or_dict takes.
+    """
+    data = dict(*args, **kwargs)
+    return record_class(data.keys())(data.values())
+
+
+def dir_dict(obj, default=None, only_public=True, compact=False):
     names = dir(obj)
     if only_public:
         names = [i for i in names if not i.startswith('_')]
-    return bunch_or_dict((i, getattr(obj, i, default)) for i in names)
+    make = compact_record if compact else bunch_or_dict
+    return make((i, getattr(obj, i, default)) for i in names)
 
 
 def requires_package(name, pypi_name=None):
     pypi_name = pypi_name or name.split('.')[0]
     msg = 'Could not import %r. Install it by running:\npip install %s'
-    enforce(safe_import(name), msg % (name, pypi_name))
-    return safe_import(name)
+    module = safe_import(name)
+    enforce(module, msg % (name, pypi_name))
+    return module
 
 
 def requires_commands(commands):
-    missing = [i for i in commands.split() if not which(i)]
+    found = which_many(commands.split())
+    missing = [i for i in commands.split() if not found[i]]
     enforce(not missing, '%r command(s) not found' % ' '.join(missing))
 
 
-def pretty_xml(xml):
+# XMLParser instances by their options, one set per process
+_xml_parsers = {}
+
+
+def _xml_parser(options):
+    key = tuple(sorted(options.items()))
+    if key not in _xml_parsers:
+        etree = requires_package('lxml.etree')
+        _xml_parsers[key] = etree.XMLParser(**options)
+    return _xml_parsers[key]
+
+
+def _pretty_xml(xml, parser):
     etree = requires_package('lxml.etree')
-    root = etree.fromstring(xml, etree.XMLParser(remove_blank_text=True))
+    root = etree.fromstring(xml, parser)
     return etree.tostring(root, pretty_print=True, encoding='unicode')
 
 
-def element_to_dict(elem, return_tuple=False):
-    children = bunch_or_dict(element_to_dict(i, True) for i in elem)
+def pretty_xml(xml):
+    return _pretty_xml(xml, _xml_parser(dict(remove_blank_text=True)))
+
+
+def element_to_dict(elem, return_tuple=False, compact=False):
+    make = compact_record if compact else bunch_or_dict
+    values = {}
+    # reversed document order visits children before their parents, which
+    # avoids recursion so deep trees can't hit the recursion limit
+    for i in reversed(list(elem.iter())):
+        children = make((j.tag, values.pop(j)) for j in i)
+        values[i] = children or i.text
     if return_tuple:
-        return elem.tag, children or elem.text
+        return elem.tag, values[elem]
     else:
         return children
 
 
+def _xml_to_dict(xml, parser, compact=False):
+    etree = requires_package('lxml.etree')
+    return element_to_dict(etree.fromstring(xml, parser), compact=compact)
+
+
 def xml_to_dict(xml, *args, **kwargs):
+    compact = kwargs.pop('compact', False)
+    etree = requires_package('lxml.etree')
+    return _xml_to_dict(xml, etree.XMLParser(*args, **kwargs), compact)
+
+
+def iter_xml_to_dict(source, tag, **kwargs):
+    """
+    Stream an XML file or file-like object and yield the element_to_dict of
+    every element matching tag. Converted elements and their earlier siblings
+    are cleared so memory use does not grow with the size of the input,
+    except inside a matching element, which is cleared once it ends.
+    Extra keyword arguments are passed to lxml.etree.iterparse.
+    """
     etree = requires_package('lxml.etree')
-    root = etree.fromstring(xml, etree.XMLParser(*args, **kwargs))
-    return element_to_dict(root)
+    events = etree.iterparse(source, ('start', 'end'), tag=tag, **kwargs)
+    depth = 0
+    for event, elem in events:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        yield element_to_dict(elem)
+        # a match nested in another match is still part of the outer record
+        if not depth:
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+
+def _xml_job(job):
+    convert, xml, options = job
+    try:
+        return convert(xml, _xml_parser(options))
+    except Exception as e:
+        # lxml errors can't be pickled back from a worker process
+        return ValueError('%s: %s' % (type(e).__name__, e))
+
+
+def _xml_many(convert, xmls, options, workers, executor, chunksize):
+    jobs = [(convert, i, options) for i in xmls]
+    workers = workers or _lazy.multiprocessing.cpu_count()
+    chunksize = chunksize or max(1, len(jobs) // (workers * 4))
+    with pool_executor(workers, executor) as pool:
+        return list(pool.map(_xml_job, jobs, chunksize=chunksize))
+
+
+def xml_to_dict_many(xmls, workers=None, executor='process', chunksize=None,
+                     **kwargs):
+    """
+    Convert many XML documents with xml_to_dict on a pool of workers, sending
+    them in chunks. Each worker reuses one XMLParser created with kwargs.
+    Results are in input order and a document that fails to parse is
+    replaced by a ValueError instead of aborting the batch.
+    """
+    return _xml_many(_xml_to_dict, xmls, kwargs, workers, executor,
+                     chunksize)
+
+
+def pretty_xml_many(xmls, workers=None, executor='process', chunksize=None):
+    """
+    Format many XML documents with pretty_xml, like xml_to_dict_many.
+    """
+    return _xml_many(_pretty_xml, xmls, dict(remove_blank_text=True),
+                     workers, executor, chunksize)
 
 
 def slicer_by_size(sizes):
-    s = [slice(sum(sizes[0:i]), sum(sizes[0:i+1])) for i in range(len(sizes))]
-    return itemgetter(*s)
+    offsets = [0]
+    for i in sizes:
+        offsets.append(offsets[-1] + i)
+    return itemgetter(*[slice(i, j) for i, j in zip(offsets, offsets[1:])])
+
+
+def _is_ruler(text):
+    return text.startswith('=') and not text.strip('= ')
+
+
+def _to_date(text):
+    return _lazy.datetime.date(int(text[:4]), int(text[5:7]), int(text[8:]))
+
+
+class CellDecoder(object):
+    """
+    Decodes the cells of one table column to the values yaml.safe_load gives.
+    Nulls, bools, ints, floats, dates and plain strings are matched with
+    regular expressions, trying the type of the previous cell first, and
+    only other cells are passed to yaml.
+    """
+    BOOLS = dict((i, j == 'true') for j, names in [
+        ('true', 'yes Yes YES true True TRUE on On ON'),
+        ('false', 'no No NO false False FALSE off Off OFF'),
+    ] for i in names.split())
+    TYPES = [
+        (r'(?:|~|null|Null|NULL)$', lambda text: None),
+        ('(?:%s)$' % '|'.join(BOOLS), BOOLS.get),
+        (r'[-+]?(?:0|[1-9][0-9]*)$', int),
+        (r'[-+]?[0-9]+\.[0-9]*(?:[eE][-+][0-9]+)?$', float),
+        (r'[0-9]{4}-[0-9]{2}-[0-9]{2}$', _to_date),
+        (r'(?!(?:~|null|Null|NULL|%s)$)[A-Za-z][A-Za-z0-9_ ./-]*$' %
+         '|'.join(BOOLS), str),
+    ]
+
+    def __init__(self):
+        re = _lazy.re
+        self.types = [(re.compile(i).match, j) for i, j in self.TYPES]
+        self.last = self.types[0]
+
+    def __call__(self, text):
+        match, convert = self.last
+        if match(text):
+            return convert(text)
+        for i in self.types:
+            if i[0](text):
+                self.last = i
+                return i[1](text)
+        return requires_package('yaml', 'PyYAML').safe_load(text)
+
+
+class TableSchema(object):
+    """
+    Column layout of a table in the format parse_table reads, compiled once
+    from its ===== ruler line and header line. rows streams rows lazily from
+    any iterable of lines such as an open file, slicing and decoding only the
+    requested columns. With typed=True each column gets a CellDecoder.
+    """
+
+    def __init__(self, ruler, header, columns=None, decoder=None,
+                 typed=False):
+        start = len(ruler) - len(ruler.lstrip())
+        spans = []
+        for i in _lazy.re.findall('=+ *', ruler[start:]):
+            spans.append((start, start + len(i)))
+            start += len(i)
+        keys = [header[i:j].strip() for i, j in spans]
+        columns = list(columns or keys)
+        missing = [i for i in columns if i not in keys]
+        if missing:
+            raise ValueError('unknown columns: %s' % ', '.join(missing))
+        self.keys = columns
+        self.slices = [slice(*spans[keys.index(i)]) for i in columns]
+        self.decoder = decoder
+        self.typed = typed
+
+    @classmethod
+    def from_lines(cls, lines, columns=None, decoder=None, typed=False):
+        """
+        Compile the schema from the ruler, header and ruler lines read from
+        the iterator lines, which is left positioned at the first row.
+        """
+        lines = (i.rstrip('\r\n') for i in lines if i.strip())
+        ruler, header, _ = next(lines), next(lines), next(lines)
+        return cls(ruler, header, columns, decoder, typed)
 
+    def values(self, lines):
+        """
+        Yield the list of column values for each line up to the closing ruler
+        line. A leading header, as found in every report sharing this schema,
+        is skipped.
+        """
+        slices, decoder = self.slices, self.decoder
+        if self.typed:
+            decoders = [CellDecoder() for i in slices]
+        header = None
+        for line in lines:
+            line = line.rstrip('\r\n')
+            text = line.strip()
+            if not text:
+                continue
+            if header is None:
+                header = _is_ruler(text)
+                if header:
+                    continue
+            elif header:
+                header = not _is_ruler(text)
+                continue
+            elif _is_ruler(text):
+                return
+            values = [line[i].strip() for i in slices]
+            if self.typed:
+                values = [f(i) for f, i in zip(decoders, values)]
+            elif decoder:
+                values = [decoder(i) for i in values]
+            yield values
+
+    def rows(self, lines, compact=False):
+        if compact:
+            make = record_class(self.keys)
+            for values in self.values(lines):
+                yield make(values)
+        else:
+            keys = self.keys
+            for values in self.values(lines):
+                yield bunch_or_dict(zip(keys, values))
 
-def parse_table(text, yaml=False):
-    if yaml:
-        decoder = requires_package('yaml', 'PyYAML').load
-    else:
-        decoder = lambda x: x
-    lines = dedent(text).strip().splitlines()
-    slicer = slicer_by_size([len(i) for i in re.findall('=+ *', lines[0])])
-    keys = [i.strip() for i in slicer(lines[1])]
-    rows = []
-    for line in lines[3:-1]:
-        values = [decoder(i.strip()) for i in slicer(line)]
-        rows.append(bunch_or_dict(zip(keys, values)))
-    return rows
+    def columns(self, lines):
+        """
+        Read the rows of lines into a dict of lists keyed by column name.
+        """
+        columns = [[] for i in self.keys]
+        appends = [i.append for i in columns]
+        for values in self.values(lines):
+            for append, value in zip(appends, values):
+                append(value)
+        return dict(zip(self.keys, columns))
+
+
+def parse_table(text, yaml=False, columns=None, output='rows',
+                compact=False):
+    """
+    Parse a table with ===== ruler lines. With yaml=True cells are decoded
+    to the values yaml.safe_load gives. output is 'rows' for a list of
+    bunch_or_dict rows, or Record rows with compact=True, 'columns' for a
+    dict of lists or 'numpy' for a dict of NumPy arrays.
+    """
+    outputs = ['rows', 'columns', 'numpy']
+    enforce(output in outputs, 'unknown output %r' % output, ValueError)
+    lines = iter(_lazy.textwrap.dedent(text).strip().splitlines())
+    schema = TableSchema.from_lines(lines, columns, typed=yaml)
+    if output == 'rows':
+        return list(schema.rows(lines, compact))
+    data = schema.columns(lines)
+    if output == 'numpy':
+        numpy = requires_package('numpy')
+        data = dict((k, numpy.array(v)) for k, v in data.items())
+    return data
 
 
 def git_version(version):
@@ -169,12 +543,16 @@ def git_version(version):
         return version
     describe = ''
     if which('git'):
-        process = Popen(['git', 'describe'], stdout=PIPE, stderr=PIPE)
+        subprocess = _lazy.subprocess
+        process = subprocess.Popen(['git', 'describe'],
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
         describe, _ = process.communicate()
     if describe:
         return version + describe.decode('utf8').split('-')[1]
     elif os.path.exists('PKG-INFO'):
         info = open('PKG-INFO').read()
+        re = _lazy.re
         return re.findall(r'^Version: (.*)$', info, re.MULTILINE)[0]
     else:
         return version
@@ -184,8 +562,9 @@ def save_args(f):
 
     @wraps(f)
     def wrapper(self, *args, **kwargs):
-        names = getargspec(f).args[1:]
-        defaults = zip(reversed(names), reversed(getargspec(f).defaults))
+        spec = _lazy.inspect.getargspec(f)
+        names = spec.args[1:]
+        defaults = zip(reversed(names), reversed(spec.defaults))
         positional = zip(names, args)
         keyword = kwargs.items()
         for k, v in itertools.chain(defaults, positional, keyword):
@@ -238,19 +617,19 @@ def get_pid_list():
 
 @contextmanager
 def TemporaryDirectory(suffix='', prefix='tmp', dir=None):
-    path = mkdtemp(suffix, prefix, dir)
+    path = _lazy.tempfile.mkdtemp(suffix, prefix, dir)
     try:
         yield path
     finally:
-        rmtree(path)
+        _lazy.shutil.rmtree(path)
 
 
 @contextmanager
 def file_lock(path):
-    from fcntl import flock, LOCK_EX, LOCK_NB
+    fcntl = _lazy.fcntl
     try:
         f = open(path, 'w')
-        flock(f, LOCK_EX | LOCK_NB)
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
     except IOError:
         f.close()
         raise IOError('Could not lock %r' % path)
@@ -263,7 +642,8 @@ def file_lock(path):
 
 def _cipher(key):
     AES = requires_package('Crypto.Cipher.AES', 'pycrypto')
-    return AES.new(sha256(key).digest(), AES.MODE_CFB, '\x00' * AES.block_size)
+    digest = _lazy.hashlib.sha256(key).digest()
+    return AES.new(digest, AES.MODE_CFB, '\x00' * AES.block_size)
 
 
 def encrypt(key, data):
@@ -306,23 +686,360 @@ def enforce_clean_exit(func):
     return wrapper
 
 
+class PathIndex(object):
+    """
+    Maps command names to the executables found in the directories of $PATH.
+    Each directory is scanned once and only scanned again when $PATH or the
+    directory's mtime changes.
+    """
+    # mtimes this close to now may not reflect a change made in the same tick
+    RACY_SECONDS = 1
+
+    def __init__(self):
+        self.path = None
+        self.dirs = {}
+        self.commands = {}
+        self.scans = 0
+        self.lock = RLock()
+
+    def stamp(self, dir):
+        try:
+            mtime = mtime_ns(os.stat(dir or os.curdir))
+        except OSError:
+            return None
+        if mtime > (time.time() - self.RACY_SECONDS) * 1e9:
+            return 'racy'
+        return mtime
+
+    def scan(self, dir):
+        scandir = getattr(os, 'scandir', None) or requires_package(
+            'scandir.scandir', 'scandir')
+        self.scans += 1
+        try:
+            return [i.name for i in scandir(dir or os.curdir)
+                    if not i.is_dir()]
+        except OSError:
+            return []
+
+    def refresh(self):
+        path = os.environ.get('PATH', '')
+        dirs = []
+        for i in path.split(os.pathsep):
+            if i not in dirs:
+                dirs.append(i)
+        stamps = dict((i, self.stamp(i)) for i in dirs)
+        if path == self.path and all(
+                stamps[i] != 'racy' and self.dirs.get(i, [0])[0] == stamps[i]
+                for i in dirs):
+            return
+        with self.lock:
+            current, entries = self.dirs, {}
+            for i in dirs:
+                mtime, names = current.get(i, (None, None))
+                if names is None or mtime != stamps[i] or mtime == 'racy':
+                    names = self.scan(i)
+                entries[i] = stamps[i], names
+            commands = {}
+            for i in dirs:
+                for name in entries[i][1]:
+                    commands.setdefault(name, []).append(os.path.join(i, name))
+            self.path, self.dirs, self.commands = path, entries, commands
+
+    def which_many(self, cmds):
+        self.refresh()
+        commands, found = self.commands, {}
+        for cmd in cmds:
+            if os.sep in cmd or (os.altsep and os.altsep in cmd):
+                paths = [cmd] if os.path.isfile(cmd) else []
+            else:
+                paths = commands.get(cmd, [])
+            found[cmd] = [i for i in paths if os.access(i, os.X_OK)]
+        return found
+
+
+path_index = PathIndex()
+
+
 def which(cmd):
-    os_paths = os.environ['PATH'].split(os.pathsep)
-    cmd_paths = [os.path.join(i, cmd) for i in os_paths]
-    return [i for i in cmd_paths if os.path.exists(i)]
+    return path_index.which_many([cmd])[cmd]
+
+
+def which_many(cmds):
+    return path_index.which_many(cmds)
+
+
+def _profile_node(samples):
+    # count, total, min, max, latest samples, children by name, start
+    return [0, 0.0, float('inf'), 0.0, deque(maxlen=samples), {}, 0.0]
+
+
+class ProfileSection(object):
+    """
+    A named section of a Profiler. Sections are cached per name and keep
+    their timing state in the calling thread's tree of nodes, so one section
+    can be entered from several threads or recursively.
+    """
+    __slots__ = ['profiler', 'name', 'local']
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.local = profiler.local
+
+    def __enter__(self):
+        try:
+            stack = self.local.stack
+        except AttributeError:
+            stack = self.profiler.thread_state()
+        children = stack[-1][5]
+        try:
+            node = children[self.name]
+        except KeyError:
+            node = children[self.name] = _profile_node(self.profiler.samples)
+        stack.append(node)
+        node[6] = timer()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        node = self.local.stack.pop()
+        duration = timer() - node[6]
+        node[0] += 1
+        node[1] += duration
+        if duration < node[2]:
+            node[2] = duration
+        if duration > node[3]:
+            node[3] = duration
+        node[4].append(duration)
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+        return wrapper
+
+
+class _ProfileSections(dict):
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def __missing__(self, name):
+        return self.setdefault(name, ProfileSection(self.profiler, name))
+
+
+class Profiler(object):
+    def __init__(self, samples=1000):
+        self.samples = samples
+        self.local = local()
+        self.lock = Lock()
+        self.threads = []
+        self.sections = _ProfileSections(self)
+        # a plain dict lookup keeps a Python call off every section entry
+        self.section = self.sections.__getitem__
+
+    def thread_state(self):
+        # a stack of nodes, starting with the root of this thread's tree
+        root = _profile_node(self.samples)
+        with self.lock:
+            self.threads.append(root)
+        stack = self.local.stack = [root]
+        return stack
+
+    def record(self, path, duration):
+        try:
+            node = self.local.stack[0]
+        except AttributeError:
+            node = self.thread_state()[0]
+        for i in path.split(';'):
+            if i not in node[5]:
+                node[5][i] = _profile_node(self.samples)
+            node = node[5][i]
+        node[0] += 1
+        node[1] += duration
+        node[2] = min(node[2], duration)
+        node[3] = max(node[3], duration)
+        node[4].append(duration)
+
+    def reset(self):
+        with self.lock:
+            for i in self.threads:
+                i[5].clear()
+
+    def merged(self):
+        merged = {}
+        with self.lock:
+            nodes = [('', i) for i in self.threads]
+        while nodes:
+            prefix, node = nodes.pop()
+            for name, child in list(node[5].items()):
+                path = prefix + name
+                nodes.append((path + ';', child))
+                count, total, low, high, samples = child[:5]
+                if not count:
+                    continue
+                stat = merged.setdefault(path, [0, 0.0, low, high, []])
+                stat[0] += count
+                stat[1] += total
+                stat[2] = min(stat[2], low)
+                stat[3] = max(stat[3], high)
+                stat[4].extend(samples)
+        return merged
+
+    def report(self, percentiles=(50, 90, 99)):
+        report = {}
+        for path, stat in self.merged().items():
+            count, total, low, high, samples = stat
+            samples = sorted(samples)
+            row = dict(count=count, total=total, min=low, max=high,
+                       mean=total / count)
+            for i in percentiles:
+                index = int(round(i / 100.0 * (len(samples) - 1)))
+                row['p%s' % i] = samples[index]
+            report[path] = row
+        return report
+
+    def to_json(self, **kwargs):
+        kwargs.setdefault('sort_keys', True)
+        return _lazy.json.dumps(self.report(), **kwargs)
+
+    def collapsed(self):
+        totals = dict((k, v[1]) for k, v in self.merged().items())
+        children = dict((i, 0.0) for i in totals)
+        for path, total in totals.items():
+            parent = path.rpartition(';')[0]
+            if parent in children:
+                children[parent] += total
+        lines = []
+        for path in sorted(totals):
+            own = max(totals[path] - children[path], 0)
+            lines.append('%s %d\n' % (path, round(own * 1e6)))
+        return ''.join(lines)
+
+
+profiler = Profiler()
+
+
+def _print_duration(msg, start):
+    print('%s: %s' % (msg, _lazy.datetime.timedelta(seconds=timer() - start)))
 
 
 @contextmanager
-def timed(msg='duration'):
+def timed(msg='duration', profiler=None):
+    if profiler:
+        with profiler.section(msg):
+            yield
+        return
     start = timer()
     yield
-    print('%s: %s' % (msg, timedelta(seconds=timer() - start)))
-
-
-def shell(cmd=None, msg=None, caller=None, strict=False, verbose=False,
-          **kwargs):
-    caller = caller or check_call
-    msg = msg if msg else cmd
+    _print_duration(msg, start)
+
+
+class Metrics(object):
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, enabled=False, buckets=BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters, self.gauges, self.histograms = {}, {}, {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = [[0] * len(self.buckets), 0, 0]
+                self.histograms[key] = histogram
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @staticmethod
+    def format_labels(labels, *extra):
+        labels = list(labels) + list(extra)
+        if not labels:
+            return ''
+
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace(
+                '"', '\\"').replace('\n', '\\n')
+
+        pairs = ['{0}="{1}"'.format(k, escape(v)) for k, v in labels]
+        return '{' + ','.join(pairs) + '}'
+
+    def render(self):
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted((k, [list(v[0]), v[1], v[2]])
+                                for k, v in self.histograms.items())
+        lines, typed = [], set()
+
+        def sample(name, labels, value, *extra):
+            lines.append('{0}{1} {2}\n'.format(
+                name, self.format_labels(labels, *extra), value))
+
+        for kind, items in [('counter', counters), ('gauge', gauges),
+                            ('histogram', histograms)]:
+            for (name, labels), value in items:
+                if name not in typed:
+                    typed.add(name)
+                    lines.append('# TYPE {0} {1}\n'.format(name, kind))
+                if kind != 'histogram':
+                    sample(name, labels, value)
+                    continue
+                counts, total, count = value
+                for bound, i in zip(self.buckets, counts):
+                    sample(name + '_bucket', labels, i, ('le', bound))
+                sample(name + '_bucket', labels, count, ('le', '+Inf'))
+                sample(name + '_sum', labels, total)
+                sample(name + '_count', labels, count)
+        return ''.join(lines)
+
+    def export(self, path):
+        swap_save(path, self.render())
+
+
+metrics = Metrics()
+
+
+def instrumented(name):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            start = timer()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                metrics.inc('utile_%s_errors_total' % name)
+                raise
+            finally:
+                metrics.inc('utile_%s_calls_total' % name)
+                metrics.observe('utile_%s_duration_seconds' % name,
+                                timer() - start)
+        return wrapper
+    return decorator
+
+
+def _shell_command(cmd, strict, verbose, kwargs):
     kwargs.setdefault('shell', True)
     if kwargs['shell']:
         kwargs.setdefault('executable', '/bin/bash')
@@ -337,11 +1054,148 @@ def shell(cmd=None, msg=None, caller=None, strict=False, verbose=False,
         set_options += 'v'
     if set_options:
         cmd = 'set -{}\n{}'.format(set_options, cmd)
+    return cmd
+
+
+def stream_call(cmd, callback=None, tail=100, **kwargs):
+    subprocess = _lazy.subprocess
+    lines, lock = deque(maxlen=tail), Lock()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, **kwargs)
+
+    def pump(stream, name):
+        for line in iter(lambda: stream.readline(64 * 1024), b''):
+            line = line.decode('utf8', 'replace')
+            with lock:
+                lines.append(line)
+                if callback:
+                    callback(name, line)
+                else:
+                    print(line, end='', file=getattr(sys, name), flush=True)
+        stream.close()
+
+    threads = [Thread(target=pump, args=(process.stdout, 'stdout')),
+               Thread(target=pump, args=(process.stderr, 'stderr'))]
+    for i in threads:
+        i.start()
+    for i in threads:
+        i.join()
+    if process.wait():
+        raise subprocess.CalledProcessError(process.returncode, cmd,
+                                            ''.join(lines))
+    return 0
+
+
+@instrumented('shell')
+def shell(cmd=None, msg=None, caller=None, strict=False, verbose=False,
+          **kwargs):
+    caller = caller or _lazy.subprocess.check_call
+    msg = msg if msg else cmd
+    cmd = _shell_command(cmd, strict, verbose, kwargs)
     print(' {0} '.format(msg).center(60, '-'))
     with timed():
         return caller(cmd, **kwargs)
 
 
+def shell_many(cmds, max_workers=4, fail_fast=False, strict=False,
+               verbose=False, **kwargs):
+    subprocess = _lazy.subprocess
+    futures = requires_package('concurrent.futures', 'futures')
+    if hasattr(cmds, 'items'):
+        jobs = [(str(name), name, cmd) for name, cmd in cmds.items()]
+    else:
+        jobs = [(str(i), cmd, cmd) for i, cmd in enumerate(cmds)]
+    print_lock, running, stop = Lock(), set(), Event()
+
+    def run(name, msg, cmd):
+        if stop.is_set():
+            return None
+        options = dict(kwargs)
+        cmd = _shell_command(cmd, strict, verbose, options)
+        start = timer()
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, **options)
+        running.add(process)
+        if stop.is_set():
+            process.kill()
+        output = process.communicate()[0].decode('utf8', 'replace')
+        running.discard(process)
+        duration = timer() - start
+        with print_lock:
+            print(' {0} '.format(msg).center(60, '-'))
+            for line in output.splitlines():
+                print('[{0}] {1}'.format(name, line))
+            _print_duration('duration', start)
+        return bunch_or_dict(name=name, cmd=cmd, output=output,
+                             returncode=process.returncode, duration=duration)
+
+    trigger = None  # the future that stopped the others with fail_fast
+    with pool_executor(max_workers) as pool:
+        pending = [pool.submit(run, *i) for i in jobs]
+        for future in futures.as_completed(pending):
+            if future.cancelled() or not fail_fast or trigger:
+                continue
+            result = None if future.exception() else future.result()
+            if future.exception() or (result and result['returncode']):
+                trigger = future
+                stop.set()
+                for i in pending:
+                    i.cancel()
+                for i in list(running):
+                    i.kill()
+    if trigger and trigger.exception():
+        raise trigger.exception()
+    results = []
+    for future in pending:
+        if future.cancelled():
+            results.append(None)
+        elif future.exception():
+            raise future.exception()
+        else:
+            results.append(future.result())
+    failed = [i for i in results if i and i['returncode']]
+    if failed:
+        # commands killed by fail_fast also fail, so name the one that failed
+        first = trigger.result() if trigger else failed[0]
+        error = subprocess.CalledProcessError(
+            first['returncode'], first['cmd'], first['output'])
+        error.results = results
+        raise error
+    return results
+
+
+def async_shell(cmd=None, msg=None, strict=False, verbose=False, **kwargs):
+    asyncio = requires_package('asyncio')
+    msg = msg if msg else cmd
+    cmd = _shell_command(cmd, strict, verbose, kwargs)
+    future = asyncio.Future()
+    print(' {0} '.format(msg).center(60, '-'))
+    start = timer()
+    if kwargs.pop('shell'):
+        spawn = asyncio.create_subprocess_shell(cmd, **kwargs)
+    else:
+        args = [cmd] if isinstance(cmd, string_types) else cmd
+        spawn = asyncio.create_subprocess_exec(*args, **kwargs)
+
+    def spawned(task):
+        if _chain_failed(task, future):
+            return
+        asyncio.ensure_future(task.result().wait()).add_done_callback(exited)
+
+    def exited(task):
+        _print_duration('duration', start)
+        if _chain_failed(task, future):
+            return
+        if task.result():
+            future.set_exception(
+                _lazy.subprocess.CalledProcessError(task.result(), cmd))
+        else:
+            future.set_result(0)
+
+    asyncio.ensure_future(spawn).add_done_callback(spawned)
+    return future
+
+
 def shell_quote(s):
     return "'" + s.replace("'", "'\"'\"'") + "'"
 
@@ -350,18 +1204,86 @@ class TimeoutError(Exception):
     pass
 
 
+class Backoff(object):
+    """
+    Exponential backoff with jitter for wait and its variants. Every wait
+    runs on its own copy, so one instance can be shared by concurrent
+    waits. attempts, predicate_time and sleep_time are copied back after
+    each attempt and describe the wait that made the latest attempt.
+    """
+    def __init__(self, delay=0.1, factor=2, max_delay=None, jitter=0):
+        self.delay = delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.source = None
+        self.reset()
+
+    def reset(self):
+        self.current = self.delay
+        self.attempts = 0
+        self.predicate_time = 0.0
+        self.sleep_time = 0.0
+
+    def next_delay(self):
+        delay = self.current
+        self.current *= self.factor
+        if self.max_delay is not None:
+            self.current = min(self.current, self.max_delay)
+        if self.jitter:
+            delay *= 1 + _lazy.random.uniform(-self.jitter, self.jitter)
+        return delay
+
+    def start(self):
+        backoff = _lazy.copy.copy(self)
+        backoff.reset()
+        backoff.source = self
+        return backoff
+
+    def publish(self):
+        if self.source is not None:
+            self.source.attempts = self.attempts
+            self.source.predicate_time = self.predicate_time
+            self.source.sleep_time = self.sleep_time
+
+
+def _wait_check(target, timeout, backoff, start, before, result):
+    now = timer()
+    backoff.attempts += 1
+    backoff.predicate_time += now - before
+    backoff.publish()
+    if bool(result) == target:
+        return None
+    duration = now - start
+    if timeout and duration > timeout:
+        raise TimeoutError('waited for %0.3fs' % duration)
+    sleep = backoff.next_delay()
+    if timeout:
+        sleep = min(sleep, timeout - duration)
+    backoff.sleep_time += sleep
+    backoff.publish()
+    return sleep
+
+
+def _backoff(delay):
+    if isinstance(delay, Backoff):
+        return delay.start()
+    return Backoff(delay, 1)
+
+
 def _wait_base(target, timeout, delay, callable, *args, **kwargs):
+    backoff = _backoff(delay)
     start = timer()
     while True:
+        before = timer()
         result = callable(*args, **kwargs)
-        if bool(result) == target:
+        sleep = _wait_check(target, timeout, backoff, start, before, result)
+        if sleep is None:
             return result
-        duration = timer() - start
-        if timeout and duration > timeout:
-            raise TimeoutError('waited for %0.3fs' % duration)
-        time.sleep(delay)
+        time.sleep(sleep)
 
 
+@instrumented('wait')
 def wait(timeout=None, delay=0.1, callable=None, *args, **kwargs):
     return _wait_base(True, timeout, delay, callable, *args, **kwargs)
 
@@ -370,8 +1292,224 @@ def wait_false(timeout=None, delay=0.1, callable=None, *args, **kwargs):
     return _wait_base(False, timeout, delay, callable, *args, **kwargs)
 
 
+def _wait_many(conditions, timeout, delay, first):
+    if hasattr(conditions, 'items'):
+        pending = list(conditions.items())
+    else:
+        pending = list(enumerate(conditions))
+    results = {}
+    backoff = _backoff(delay)
+    start = timer()
+    while True:
+        before = timer()
+        remaining = []
+        for name, callable in pending:
+            result = callable()
+            if not result:
+                remaining.append((name, callable))
+            elif first:
+                return name, result
+            else:
+                results[name] = result
+        pending = remaining
+        try:
+            sleep = _wait_check(True, timeout, backoff, start, before,
+                                not pending)
+        except TimeoutError as e:
+            names = [i[0] for i in pending]
+            error = TimeoutError('%s, pending: %r' % (e, names))
+            error.pending = names
+            raise error
+        if sleep is None:
+            return results
+        time.sleep(sleep)
+
+
+def wait_all(conditions, timeout=None, delay=0.1):
+    results = _wait_many(conditions, timeout, delay, False)
+    if hasattr(conditions, 'items'):
+        return results
+    return [results[i] for i in range(len(results))]
+
+
+def wait_any(conditions, timeout=None, delay=0.1):
+    if not hasattr(conditions, 'items'):
+        conditions = list(conditions)
+    enforce(len(conditions), 'wait_any needs at least one condition',
+            ValueError)
+    return _wait_many(conditions, timeout, delay, True)
+
+
+def _chain_failed(task, future):
+    if future.done():
+        return True
+    if task.cancelled():
+        future.cancel()
+        return True
+    if task.exception() is not None:
+        future.set_exception(task.exception())
+        return True
+    return False
+
+
+def _async_wait_base(target, timeout, delay, callable, *args, **kwargs):
+    asyncio = requires_package('asyncio')
+    loop = asyncio.get_event_loop()
+    future = asyncio.Future()
+    backoff = _backoff(delay)
+    start = timer()
+
+    def attempt():
+        if future.done():
+            return
+        before = timer()
+        try:
+            result = callable(*args, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        if asyncio.iscoroutine(result) or asyncio.isfuture(result):
+            task = asyncio.ensure_future(result)
+            task.add_done_callback(lambda task: awaited(task, before))
+        else:
+            check(result, before)
+
+    def awaited(task, before):
+        if not _chain_failed(task, future):
+            check(task.result(), before)
+
+    def check(result, before):
+        try:
+            sleep = _wait_check(target, timeout, backoff, start, before,
+                                result)
+        except TimeoutError as e:
+            future.set_exception(e)
+            return
+        if sleep is None:
+            future.set_result(result)
+        else:
+            loop.call_later(sleep, attempt)
+
+    loop.call_soon(attempt)
+    return future
+
+
+def async_wait(timeout=None, delay=0.1, callable=None, *args, **kwargs):
+    return _async_wait_base(True, timeout, delay, callable, *args, **kwargs)
+
+
+def async_wait_false(timeout=None, delay=0.1, callable=None, *args,
+                     **kwargs):
+    return _async_wait_base(False, timeout, delay, callable, *args, **kwargs)
+
+
+class Inotify(object):
+    IN_MODIFY, IN_ATTRIB, IN_CLOSE_WRITE = 0x2, 0x4, 0x8
+    IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE = 0x40, 0x80, 0x100, 0x200
+    IN_DELETE_SELF, IN_MOVE_SELF, IN_IGNORED = 0x400, 0x800, 0x8000
+    IN_NONBLOCK, IN_CLOEXEC = 0o4000, 0o2000000
+    DIR_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+                IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF |
+                IN_MOVE_SELF)
+
+    def __init__(self):
+        ctypes = _lazy.ctypes
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify requires Linux')
+        self.ctypes = ctypes
+        self.libc = ctypes.CDLL(_lazy.ctypes_util.find_library('c'),
+                                use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            self.raise_errno('inotify_init1')
+
+    def raise_errno(self, *args):
+        code = self.ctypes.get_errno()
+        raise OSError(code, os.strerror(code), *args)
+
+    def add_watch(self, path, mask):
+        if not isinstance(path, bytes):
+            path = path.encode(sys.getfilesystemencoding())
+        wd = self.libc.inotify_add_watch(self.fd, path, mask)
+        if wd < 0:
+            self.raise_errno(path)
+        return wd
+
+    def read(self, timeout=None):
+        if not _lazy.select.select([self.fd], [], [], timeout)[0]:
+            return []
+        masks = []
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            event = _lazy.struct.unpack_from('iIII', data, offset)
+            wd, mask, cookie, size = event
+            masks.append(mask)
+            offset += 16 + size
+        return masks
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _wait_inotify(path, predicate, timeout, delay):
+    directory = os.path.dirname(os.path.abspath(path))
+    try:
+        inotify = Inotify()
+    except (OSError, AttributeError):
+        return _wait_base(True, timeout, delay, predicate)
+    start = timer()
+    with inotify:
+        try:
+            inotify.add_watch(directory, Inotify.DIR_MASK)
+        except OSError:
+            return _wait_base(True, timeout, delay, predicate)
+        while True:
+            result = predicate()
+            if result:
+                return result
+            duration = timer() - start
+            if timeout and duration > timeout:
+                raise TimeoutError('waited for %0.3fs' % duration)
+            masks = inotify.read(timeout - duration if timeout else None)
+            if any(i & Inotify.IN_IGNORED for i in masks):
+                remaining = timeout - (timer() - start) if timeout else None
+                return _wait_base(True, remaining and max(remaining, 1e-6),
+                                  delay, predicate)
+
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_size, mtime_ns(stat)
+
+
+def wait_for_path(path, timeout=None, exists=True, delay=0.1):
+    def predicate():
+        return os.path.exists(path) == exists
+
+    return _wait_inotify(path, predicate, timeout, delay)
+
+
+def wait_for_change(path, timeout=None, delay=0.1):
+    initial = file_signature(path)
+
+    def predicate():
+        return file_signature(path) != initial
+
+    return _wait_inotify(path, predicate, timeout, delay)
+
+
 def reformat_query(query, *args, **kwargs):
-    f = string.Formatter()
+    f = _lazy.string.Formatter()
     parsed = list(f.parse(query))
     query = '?'.join([i[0] for i in parsed])
     fields = [i[1] for i in parsed if i[1] is not None]
@@ -385,19 +1523,37 @@ class Arg(object):
         self.kwargs = kwargs
 
 
-class UtileArgFormatter(ArgumentDefaultsHelpFormatter,
-                        RawDescriptionHelpFormatter):
-        """
-        Help message formatter which adds default values to argument help and
-        which retains any formatting in descriptions.
-        """
+def _arg_formatter():
+    if 'UtileArgFormatter' not in globals():
+        argparse = _lazy.argparse
+
+        class UtileArgFormatter(argparse.ArgumentDefaultsHelpFormatter,
+                                argparse.RawDescriptionHelpFormatter):
+            """
+            Help message formatter which adds default values to argument help
+            and which retains any formatting in descriptions.
+            """
+
+        globals()['UtileArgFormatter'] = UtileArgFormatter
+    return globals()['UtileArgFormatter']
+
+
+def __getattr__(name):
+    if name == 'UtileArgFormatter':
+        return _arg_formatter()
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
+
+
+# module __getattr__ is only supported from Python 3.7
+if sys.version_info < (3, 7):
+    _arg_formatter()
 
 
 def arg_parser(description, *args, **kwargs):
     kwargs['description'] = description
-    kwargs.setdefault('formatter_class', UtileArgFormatter)
+    kwargs.setdefault('formatter_class', _arg_formatter())
     autocomplete = kwargs.pop('autocomplete', True)
-    parser = ArgumentParser(**kwargs)
+    parser = _lazy.argparse.ArgumentParser(**kwargs)
     for i in args:
         completer = i.kwargs.pop('completer', None)
         action = parser.add_argument(*i.args, **i.kwargs)
@@ -429,10 +1585,12 @@ def write_file(path, data, mode='w'):
             f.writelines(data)
 
 
+@instrumented('swap_save')
 def swap_save(path, data, mode='w'):
     dir = os.path.dirname(path)
-    swap = NamedTemporaryFile(prefix='swap_save_', suffix='.swap',
-                              delete=False, dir=dir)
+    swap = _lazy.tempfile.NamedTemporaryFile(prefix='swap_save_',
+                                             suffix='.swap',
+                                             delete=False, dir=dir)
     os.chmod(swap.name, 0o664)
     write_file(swap.name, data, mode)
     os.rename(swap.name, path)
@@ -452,22 +1610,273 @@ def safe_mkdir(path, mode=0o777):
             raise
 
 
+class _SlotTable(object):
+    """
+    Hash table of fixed width key slots in a mapped file, used by the
+    ThrottleFilter counter backend. It has twice as many slots as capacity
+    and finds keys by linear probing, so up to capacity keys always fit.
+    Slots are also linked from the least to the most recently used, and
+    only when the table is full is the least recently used key evicted.
+    Every operation reads and writes a few slots, not the whole table.
+    """
+    HEADER = '<III'             # count, oldest and newest slot
+    SLOT = '<16sdIII92s'        # digest, seen, suppressed, prev, next, state
+    EMPTY = b'\0' * 16
+
+    def __init__(self, buffer, capacity):
+        self.buffer = buffer
+        self.length = 2 * capacity
+        self.capacity = capacity
+        self.header = _lazy.struct.Struct(self.HEADER)
+        self.slot = _lazy.struct.Struct(self.SLOT)
+        self.count, self.oldest, self.newest = self.header.unpack_from(buffer)
+
+    @classmethod
+    def size(cls, capacity):
+        struct = _lazy.struct
+        return (struct.calcsize(cls.HEADER) +
+                2 * capacity * struct.calcsize(cls.SLOT))
+
+    def offset(self, index):
+        # slots are numbered from 1, 0 is the end of the list
+        return self.header.size + (index - 1) * self.slot.size
+
+    def read(self, index):
+        return list(self.slot.unpack_from(self.buffer, self.offset(index)))
+
+    def write(self, index, slot):
+        self.slot.pack_into(self.buffer, self.offset(index), *slot)
+
+    def home(self, digest):
+        return _lazy.struct.unpack('<I', digest[:4])[0] % self.length + 1
+
+    def find(self, digest):
+        index = self.home(digest)
+        while True:
+            found = self.buffer[self.offset(index):self.offset(index) + 16]
+            if found in (digest, self.EMPTY):
+                return index, found == digest
+            index = index % self.length + 1
+
+    def get(self, digest):
+        """Return the slot index and slot of digest, adding it if needed."""
+        index, found = self.find(digest)
+        if found:
+            slot = self.read(index)
+            self.unlink(index, slot)
+            return index, slot
+        if self.count >= self.capacity:
+            self.evict()
+            index = self.find(digest)[0]
+        self.count += 1
+        return index, [digest, 0.0, 0, 0, 0, b'']
+
+    def put(self, index, slot):
+        """Store slot as the most recently used."""
+        slot[3:5] = self.newest, 0
+        if self.newest:
+            self.relink(self.newest, 4, index)
+        else:
+            self.oldest = index
+        self.newest = index
+        self.write(index, slot)
+        self.header.pack_into(self.buffer, 0, self.count, self.oldest,
+                              self.newest)
+
+    def relink(self, index, field, value):
+        slot = self.read(index)
+        slot[field] = value
+        self.write(index, slot)
+
+    def unlink(self, index, slot):
+        prev, next = slot[3:5]
+        if prev:
+            self.relink(prev, 4, next)
+        else:
+            self.oldest = next
+        if next:
+            self.relink(next, 3, prev)
+        else:
+            self.newest = prev
+
+    def evict(self):
+        hole = self.oldest
+        self.unlink(hole, self.read(hole))
+        self.count -= 1
+        # shift later keys of the probe run back, so no tombstones are needed
+        index = hole
+        while True:
+            index = index % self.length + 1
+            slot = self.read(index)
+            if slot[0] == self.EMPTY:
+                break
+            home = self.home(slot[0])
+            if hole < index:
+                reachable = hole < home <= index
+            else:
+                reachable = home > hole or home <= index
+            if not reachable:
+                self.move(index, hole, slot)
+                hole = index
+        self.write(hole, [self.EMPTY, 0.0, 0, 0, 0, b''])
+
+    def move(self, index, to, slot):
+        prev, next = slot[3:5]
+        if prev:
+            self.relink(prev, 4, to)
+        else:
+            self.oldest = to
+        if next:
+            self.relink(next, 3, to)
+        else:
+            self.newest = to
+        self.write(to, slot)
+
+
+def record_fingerprint(record):
+    exc_type = record.exc_info[0].__name__ if record.exc_info else ''
+    return '{0}|{1}'.format(record.msg, exc_type)
+
+
 class ThrottleFilter(object):
     PERIOD_FORMAT = dict(hour='stamp_%Y-%m-%d_%H', day='stamp_%Y-%m-%d')
+    PERIOD_SECONDS = dict(hour=3600, day=86400)
+    MODES = dict(fixed='fixed_window', sliding='sliding_window',
+                 token='token_bucket')
+    BACKENDS = ['files', 'counter']
+    KEYS = dict(logger=attrgetter('name'), level=attrgetter('levelname'),
+                message=record_fingerprint)
 
     @save_args
-    def __init__(self, dir, limit, period='hour'):
+    def __init__(self, dir, limit, period='hour', backend=None, mode='fixed',
+                 burst=None, key=None, max_keys=1000, summary=False):
         self.dir = self.dir
-        self.pformat = self.PERIOD_FORMAT[self.period]
+        enforce(mode in self.MODES, 'invalid mode %r' % mode, ValueError)
+        if backend is None:
+            simple = mode == 'fixed' and not (key or summary)
+            self.backend = 'files' if simple else 'counter'
+        enforce(self.backend in self.BACKENDS,
+                'invalid backend %r' % self.backend, ValueError)
+        enforce(mode == 'fixed' or self.backend == 'counter',
+                '%r mode requires the counter backend' % mode, ValueError)
+        enforce(not (key or summary) or self.backend == 'counter',
+                'key and summary require the counter backend', ValueError)
+        self.key_func = key if callable(key) else self.KEYS.get(key)
+        enforce(self.key_func or key is None, 'invalid key %r' % key,
+                ValueError)
+        self.pformat = self.PERIOD_FORMAT.get(period)
+        self.seconds = float(self.PERIOD_SECONDS.get(period, period))
+        self.burst = burst or limit
+        self.rate = limit / self.seconds
+        self.counter_path = os.path.join(self.dir, 'counter.slots')
+        self.capacity = max(max_keys, 1)
+
+    def stamp(self, now):
+        if self.pformat:
+            return _lazy.datetime.datetime.now().strftime(self.pformat)
+        return 'stamp_%d' % (now // self.seconds)
 
     def cleanup(self, latest):
         for i in os.listdir(self.dir):
             if i != os.path.basename(latest):
-                rmtree(os.path.join(self.dir, i), ignore_errors=True)
+                _lazy.shutil.rmtree(os.path.join(self.dir, i),
+                                    ignore_errors=True)
 
+    @instrumented('throttle_filter')
     def filter(self, record):
+        if self.backend == 'counter':
+            return self.filter_counter(record)
+        return self.filter_files(record)
+
+    def filter_counter(self, record):
+        if getattr(record, 'throttle_summary', False):
+            return 1
+        key = str(self.key_func(record)) if self.key_func else ''
+        method = getattr(self, self.MODES[self.mode])
+        now = time.time()
+        suppressed = 0
+        with self.locked_slot(key) as entry:
+            entry['seen'] = now
+            allowed = method(entry['state'], now)
+            if not allowed:
+                entry['suppressed'] += 1
+            elif entry['suppressed']:
+                suppressed, entry['suppressed'] = entry['suppressed'], 0
+        if suppressed and self.summary:
+            self.emit_summary(record, key, suppressed)
+        return 1 if allowed else 0
+
+    @contextmanager
+    def locked_slot(self, key):
+        """
+        Lock the counter file, a _SlotTable of max_keys keys, and yield the
+        entry of key.
+        """
+        digest = _lazy.hashlib.sha256(key.encode('utf-8')).digest()[:16]
+        size = _SlotTable.size(self.capacity)
+        with open(self.counter_path, 'a+b') as f:
+            _lazy.fcntl.flock(f, _lazy.fcntl.LOCK_EX)
+            if os.fstat(f.fileno()).st_size != size:
+                f.truncate(0)   # new, corrupt or sized for other max_keys
+                f.truncate(size)
+            with closing(_lazy.mmap.mmap(f.fileno(), size)) as buffer:
+                table = _SlotTable(buffer, self.capacity)
+                index, slot = table.get(digest)
+                entry = dict(state={}, suppressed=slot[2])
+                try:
+                    state = slot[5].rstrip(b'\0').decode('utf-8')
+                    entry['state'] = _lazy.json.loads(state or '{}')
+                except ValueError:
+                    pass
+                yield entry
+                state = _lazy.json.dumps(entry['state'], separators=(',', ':'))
+                slot[1:3] = entry['seen'], entry['suppressed']
+                slot[5] = state.encode('utf-8')
+                table.put(index, slot)
+
+    def emit_summary(self, record, key, count):
+        logging = _lazy.logging
+        logger = logging.getLogger(record.name)
+        msg = '%d records suppressed by ThrottleFilter for key %r'
+        summary = logger.makeRecord(
+            record.name, logging.WARNING, record.pathname, record.lineno,
+            msg, (count, key), None)
+        summary.throttle_summary = True
+        logger.handle(summary)
+
+    def fixed_window(self, state, now):
+        stamp = self.stamp(now)
+        if state.get('period') != stamp:
+            state.clear()
+            state.update(period=stamp, count=0)
+        state['count'] += 1
+        return state['count'] <= self.limit
+
+    def sliding_window(self, state, now):
+        window = int(now // self.seconds)
+        if state.get('window') != window:
+            adjacent = state.get('window') == window - 1
+            previous = state.get('count', 0) if adjacent else 0
+            state.clear()
+            state.update(window=window, count=0, previous=previous)
+        weight = 1 - (now / self.seconds - window)
+        if state['previous'] * weight + state['count'] < self.limit:
+            state['count'] += 1
+            return True
+        return False
+
+    def token_bucket(self, state, now):
+        elapsed = max(now - state.get('time', now), 0)
+        tokens = min(self.burst, state.get('tokens', self.burst) +
+                     elapsed * self.rate)
+        allowed = tokens >= 1
+        state.clear()
+        state.update(tokens=tokens - 1 if allowed else tokens, time=now)
+        return allowed
+
+    def filter_files(self, record):
         id = 'pid{}-thread{}'.format(os.getpid(), get_ident())
-        path = os.path.join(self.dir, datetime.now().strftime(self.pformat))
+        path = os.path.join(self.dir, self.stamp(time.time()))
         safe_mkdir(path)
         self.cleanup(path)
         files = os.listdir(path)
@@ -490,35 +1899,252 @@ def buffered_read(reader, callback, buffer_size=10*1024):
         callback(data)
 
 
-def hash_file(path, algorithm='md5'):
+def buffered_readinto(readinto, callback, buffer_size=10*1024):
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    while True:
+        size = readinto(buffer)
+        if not size:
+            break
+        callback(view[:size])
+
+
+def buffer_size_for(size, minimum=4*1024, maximum=1024*1024):
+    return min(max(size + 1, minimum), maximum)
+
+
+@instrumented('hash_file')
+def hash_file(path, algorithm='md5', mode='readinto'):
     pathlib = requires_package('pathlib')
     path = pathlib.Path(path)
-    hash = hashlib.new(algorithm)
+    algorithms = _algorithms(algorithm)
+    hashes = [_lazy.hashlib.new(i) for i in algorithms]
+    if len(hashes) == 1:
+        update = hashes[0].update
+    else:
+        def update(data):
+            for i in hashes:
+                i.update(data)
     with path.open('rb') as f:
-        buffered_read(f.read, hash.update)
-    return hash
+        size = os.fstat(f.fileno()).st_size
+        if mode == 'mmap' and size:
+            mmap = _lazy.mmap
+            with closing(mmap.mmap(f.fileno(), 0,
+                                   access=mmap.ACCESS_READ)) as data:
+                update(data)
+        elif mode in ('readinto', 'mmap'):
+            buffered_readinto(f.readinto, update, buffer_size_for(size))
+        else:
+            buffered_read(f.read, update)
+    if isinstance(algorithm, string_types):
+        return hashes[0]
+    return dict(zip(algorithms, hashes))
 
 
-def hash_dir(path, algorithm='md5'):
-    pathlib = requires_package('pathlib')
-    path = pathlib.Path(path)
-    files = [i for i in sorted(path.glob('**/*')) if i.is_file()]
-    hashes = ''
-    for i in files:
-        hash = hash_file(i, algorithm).hexdigest()
-        file = i.relative_to(path)
-        hashes += '{hash}  ./{file}\n'.format(hash=hash, file=file)
-    return hashes
+def _algorithms(algorithm):
+    if isinstance(algorithm, string_types):
+        return [algorithm]
+    return list(algorithm)
+
+
+def _hexdigests(job):
+    path, algorithms = job
+    hashes = hash_file(path, algorithms)
+    return [hashes[i].hexdigest() for i in algorithms]
+
 
+EXECUTORS = dict(thread='ThreadPoolExecutor', process='ProcessPoolExecutor')
+
+
+def pool_executor(workers, executor='thread'):
+    futures = requires_package('concurrent.futures', 'futures')
+    return getattr(futures, EXECUTORS[executor])(workers)
+
+
+def path_matcher(patterns):
+    if not patterns:
+        return None
+    if isinstance(patterns, string_types) or hasattr(patterns, 'search'):
+        patterns = [patterns]
+    regexes = []
+    for i in patterns:
+        if hasattr(i, 'search'):
+            regexes.append(i)
+        elif '/' in i:
+            regexes.append(_lazy.re.compile('^' + _lazy.fnmatch.translate(i)))
+        else:
+            regexes.append(
+                _lazy.re.compile('(?:^|/)' + _lazy.fnmatch.translate(i)))
+    if os.sep != '/':
+        return lambda name: any(
+            i.search(name.replace(os.sep, '/')) for i in regexes)
+    return lambda name: any(i.search(name) for i in regexes)
+
+
+def walk_files(path, include=None, exclude=None):
+    scandir = getattr(os, 'scandir', None) or requires_package(
+        'scandir.scandir', 'scandir')
+    include, exclude = path_matcher(include), path_matcher(exclude)
+    by_name = attrgetter('name')
+    stack = [(iter(sorted(scandir(path), key=by_name)), '')]
+    while stack:
+        entries, prefix = stack[-1]
+        for entry in entries:
+            name = prefix + entry.name
+            if exclude and exclude(name):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                children = iter(sorted(scandir(entry.path), key=by_name))
+                stack.append((children, name + os.sep))
+                break
+            if entry.is_file() and (not include or include(name)):
+                yield entry, name
+        else:
+            stack.pop()
 
-def stamp_dir(path, format='{file} {size} {mtime}\n'):
+
+def mtime_ns(stat):
+    return getattr(stat, 'st_mtime_ns', int(stat.st_mtime * 1e9))
+
+
+class HashCache(object):
+    # files modified this recently may change again without changing their key
+    RACY_SECONDS = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.hits, self.misses, self.evictions = 0, 0, 0
+        self.entries = self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return _lazy.json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def save(self):
+        swap_save(self.path, _lazy.json.dumps(self.entries, sort_keys=True))
+
+    @staticmethod
+    def key(stat):
+        return [stat.st_size, mtime_ns(stat), stat.st_ino]
+
+    def get(self, name, stat, algorithms):
+        entry = self.entries.get(name)
+        if entry and entry['key'] == self.key(stat):
+            digests = [entry['digests'].get(i) for i in algorithms]
+            if all(digests):
+                self.hits += 1
+                return digests
+        self.misses += 1
+
+    def set(self, name, stat, algorithms, digests):
+        if mtime_ns(stat) > (time.time() - self.RACY_SECONDS) * 1e9:
+            self.entries.pop(name, None)
+            return
+        key = self.key(stat)
+        entry = self.entries.get(name)
+        if not entry or entry['key'] != key:
+            entry = self.entries[name] = dict(key=key, digests={})
+        entry['digests'].update(zip(algorithms, digests))
+
+    def prune(self, names):
+        names = set(names)
+        stale = [i for i in self.entries if i not in names]
+        for i in stale:
+            del self.entries[i]
+        self.evictions += len(stale)
+        return len(stale)
+
+
+def _finish_digests(item, algorithms, cache):
+    name, stat, digests, miss = item
+    if hasattr(digests, 'result'):
+        digests = digests.result()
+    if cache and miss:
+        cache.set(name, stat, algorithms, digests)
+    return name, digests
+
+
+def _iter_digests(path, algorithms, cache=None, pool=None, window=0,
+                  include=None, exclude=None):
+    pending = deque()
+    names = set()
+    for entry, name in walk_files(path, include, exclude):
+        stat = entry.stat() if cache else None
+        digests = cache.get(name, stat, algorithms) if cache else None
+        miss = not digests
+        if miss:
+            job = (entry.path, algorithms)
+            if pool:
+                digests = pool.submit(_hexdigests, job)
+            else:
+                digests = _hexdigests(job)
+        if cache:
+            names.add(name)
+        pending.append((name, stat, digests, miss))
+        while len(pending) > window:
+            yield _finish_digests(pending.popleft(), algorithms, cache)
+    while pending:
+        yield _finish_digests(pending.popleft(), algorithms, cache)
+    if cache:
+        cache.prune(names)
+        cache.save()
+
+
+def iter_hash_dir(path, algorithm='md5', workers=None, executor='thread',
+                  cache=None, include=None, exclude=None):
+    algorithms = _algorithms(algorithm)
+    single = isinstance(algorithm, string_types)
+    line = '{hash}  ./{file}\n'.format
+
+    def lines(items):
+        for file, digests in items:
+            if single:
+                yield line(hash=digests[0], file=file)
+            else:
+                yield dict((i, line(hash=hash, file=file))
+                           for i, hash in zip(algorithms, digests))
+
+    if workers:
+        with pool_executor(workers, executor) as pool:
+            items = _iter_digests(path, algorithms, cache, pool, workers * 4,
+                                  include, exclude)
+            for i in lines(items):
+                yield i
+    else:
+        items = _iter_digests(path, algorithms, cache, None, 0, include,
+                              exclude)
+        for i in lines(items):
+            yield i
+
+
+def hash_dir(path, algorithm='md5', workers=None, executor='thread',
+             cache=None, include=None, exclude=None):
+    lines = iter_hash_dir(path, algorithm, workers, executor, cache, include,
+                          exclude)
+    if isinstance(algorithm, string_types):
+        return ''.join(lines)
+    manifests = dict((i, []) for i in _algorithms(algorithm))
+    for i in lines:
+        for algorithm, line in i.items():
+            manifests[algorithm].append(line)
+    return dict((k, ''.join(v)) for k, v in manifests.items())
+
+
+def iter_stamp_dir(path, format='{file} {size} {mtime}\n', include=None,
+                   exclude=None):
     pathlib = requires_package('pathlib')
     path = pathlib.Path(path)
-    files = [i for i in sorted(path.glob('**/*')) if i.is_file()]
-    stamp = ''
-    for file in files:
-        stat = file.stat()
+    for entry, name in walk_files(str(path), include, exclude):
+        stat = entry.stat()
         size = stat.st_size
-        mtime = datetime.fromtimestamp(stat.st_mtime)
-        stamp += format.format(file=file, stat=stat, mtime=mtime, size=size)
-    return stamp
+        mtime = _lazy.datetime.datetime.fromtimestamp(stat.st_mtime)
+        file = path / name
+        yield format.format(file=file, stat=stat, mtime=mtime, size=size)
+
+
+def stamp_dir(path, format='{file} {size} {mtime}\n', include=None,
+              exclude=None):
+    return ''.join(iter_stamp_dir(path, format, include, exclude))